@@ -1,15 +1,482 @@
-from flask import Flask, jsonify, request, abort
-from models import setup_db, db, Customer, Item, Orders
-from datetime import date
-from auth import AuthError, requires_auth
+import os
+from flask import Flask, request, abort, Response, stream_with_context
+from models import (setup_db, db, Customer, Item, Orders, DailySales,
+                    bump_version, get_versions, item_catalog,
+                    add_daily_sales, delete_orders, reserve_stock,
+                    reserve_stock_many)
+from datetime import date, timedelta
+from sqlalchemy.dialects import postgresql
+from auth import (AuthError, requires_auth, token_cache,
+                  configure as configure_auth)
+from metrics import init_metrics, generate_metrics, set_error
+from compression import init_compression
+from serialization import (init_serialization, jsonify, dumps,
+                           wants_msgpack, msgpack_packer, get_request_body,
+                           JSON_MIMETYPE, MSGPACK_MIMETYPE)
+from prometheus_client import CONTENT_TYPE_LATEST
 from flask_cors import CORS
 
+# page size used by the list endpoints when no 'limit' is requested
+DEFAULT_PAGE_SIZE = 100
+# largest page size a client can request
+MAX_PAGE_SIZE = 1000
+# rows fetched from the database cursor at a time when streaming a list
+STREAM_BATCH_SIZE = 500
+# largest number of records accepted by the bulk endpoints
+MAX_BULK_SIZE = 5000
+# rows per multi-row INSERT statement in the bulk endpoints
+BULK_INSERT_CHUNK_SIZE = 1000
+
+
+# keys of the list endpoints and the columns they are read from, a
+# ?fields= parameter selects a subset of them
+
+CUSTOMER_FIELDS = {'id': Customer.id, 'name': Customer.name,
+                   'email': Customer.email}
+ITEM_FIELDS = {'id': Item.id, 'name': Item.name, 'brand': Item.brand,
+               'price': Item.price}
+ORDER_FIELDS = {'id': Orders.id, 'order_date': Orders.order_date,
+                'customer_name': Customer.name.label('customer_name'),
+                'item_name': Item.name.label('item_name'),
+                'quantity': Orders.quantity}
+
+
+def get_fields(fields):
+    '''
+    Parse the sparse fieldset of a list request, ?fields=<key>,<key>,...
+    out of the keys of 'fields'. Returns the selected keys in the order of
+    'fields', always including 'id' (the pagination cursor), or every key
+    without ?fields=. Unknown keys are a 400.
+    '''
+    requested = request.args.get('fields')
+    if requested is None:
+        return list(fields)
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    if not names or not names.issubset(fields):
+        abort(400)
+    names.add('id')
+    return [name for name in fields if name in names]
+
+
+def select_fields(fields, names):
+    # the columns of the keys 'names', so only those are SELECTed
+    return [fields[name] for name in names]
+
+
+def format_fields(names):
+    # returns the function formatting a row as a dict of the keys 'names'
+    return lambda row: {name: getattr(row, name) for name in names}
+
+
+def get_page_args():
+    '''
+    Parse the keyset pagination parameters of a list request:
+    ?limit=<page size>&after=<id of the last row of the previous page>
+    '''
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        abort(400)
+    if limit < 1 or after < 0:
+        abort(400)
+    # enforce the maximum page size
+    return min(limit, MAX_PAGE_SIZE), after
+
+
+def paginate(query, id_column):
+    '''
+    Return one page of 'query' ordered by 'id_column' together with the
+    cursor of the next page ('None' on the last page). Only rows after the
+    cursor are read (WHERE id > :after ORDER BY id LIMIT n), so the cost of
+    a page does not depend on the size of the table.
+    '''
+    limit, after = get_page_args()
+    # one extra row tells whether there is a next page
+    rows = query.filter(id_column > after).order_by(
+        id_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+
+# filters of the list endpoints, applied by the database
+
+def escape_like(value):
+    # match 'value' literally inside a LIKE pattern
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace(
+        '_', '\\_')
+
+
+def search_condition(*columns):
+    '''
+    Condition of the ?q= search: a case-insensitive substring match on any
+    of 'columns' (ILIKE '%q%', served by the trigram indexes of the
+    search migration). None when no search was requested.
+    '''
+    term = request.args.get('q', '').strip()
+    if not term:
+        return None
+    pattern = '%{}%'.format(escape_like(term))
+    return db.or_(*[column.ilike(pattern, escape='\\')
+                    for column in columns])
+
+
+def get_price_range():
+    # ?min_price= and ?max_price=, both optional and both included
+    try:
+        min_price = request.args.get('min_price')
+        max_price = request.args.get('max_price')
+        min_price = int(min_price) if min_price is not None else None
+        max_price = int(max_price) if max_price is not None else None
+    except ValueError:
+        abort(400)
+    if ((min_price is not None and min_price < 0)
+            or (max_price is not None and max_price < 0)
+            or (min_price is not None and max_price is not None
+                and min_price > max_price)):
+        abort(400)
+    return min_price, max_price
+
+
+def filter_customers(query):
+    # ?q= searches the customer name and email
+    condition = search_condition(Customer.name, Customer.email)
+    if condition is not None:
+        query = query.filter(condition)
+    return query
+
+
+def filter_items(query):
+    # ?q= searches the item name and brand, ?brand= selects one brand<br>
+    # (ignoring case) and ?min_price=/?max_price= a price range
+    condition = search_condition(Item.name, Item.brand)
+    if condition is not None:
+        query = query.filter(condition)
+    brand = request.args.get('brand', '').strip()
+    if brand:
+        query = query.filter(db.func.lower(Item.brand) == brand.lower())
+    min_price, max_price = get_price_range()
+    if min_price is not None:
+        query = query.filter(Item.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Item.price <= max_price)
+    return query
+
+
+def count_rows(id_column):
+    # let the database count the rows (SELECT count(id) FROM ...) instead<br>
+    # of loading every row to count them in python
+    return db.session.query(db.func.count(id_column)).scalar()
+
+
+def list_etag(*tables, versions=None):
+    '''
+    ETag of a list response, built from the version stamps of the tables
+    the response reads, or from the 'versions' the caller already read.
+    The versions are read before the rows, so a write in between can only
+    make the ETag older than the data, never newer.
+    '''
+    if versions is None:
+        versions = get_versions(*tables)
+    etag = '-'.join('{}.{}'.format(table, versions[table])
+                    for table in tables)
+    # JSON and MessagePack responses are different representations
+    if wants_msgpack():
+        etag += '-msgpack'
+    return etag
+
+
+def not_modified(etag):
+    # answer a conditional GET whose copy is still current without<br>
+    # querying the rows at all
+    # If-None-Match compares weakly, compressed responses carry weak ETags
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def stream_requested():
+    # list endpoints stream their full result with ?stream=true
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_list(name, query, id_column, format_row, count_name=None):
+    '''
+    Stream every row of 'query' after the 'after' cursor as a JSON response
+    with the rows in a list under 'name' (and their number under
+    'count_name'). Rows are read from a server-side cursor in batches of
+    STREAM_BATCH_SIZE and written out batch by batch, so time to first byte
+    and memory use stay flat no matter how many rows there are.
+    '''
+    _, after = get_page_args()
+    query = query.filter(id_column > after).order_by(id_column)
+    if wants_msgpack():
+        return stream_msgpack(name, query, format_row, count_name)
+    # yield_per reads the rows through a server-side cursor
+    rows = query.yield_per(STREAM_BATCH_SIZE)
+
+    def generate():
+        yield b'{"success":true,"status_code":200,%s:[' % dumps(name)
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(dumps(format_row(row)))
+            if len(batch) == STREAM_BATCH_SIZE:
+                yield (b',' if count else b'') + b','.join(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            yield (b',' if count else b'') + b','.join(batch)
+            count += len(batch)
+        if count_name:
+            yield b'],%s:%d}' % (dumps(count_name), count)
+        else:
+            yield b']}'
+
+    # keep the request (and database session) around while streaming
+    return Response(stream_with_context(generate()),
+                    mimetype=JSON_MIMETYPE)
+
+
+def stream_msgpack(name, query, format_row, count_name=None):
+    '''
+    MessagePack version of stream_list. A MessagePack array starts with its
+    length, so the rows are counted first with a COUNT of the same query.
+    Both statements run in one REPEATABLE READ transaction and see the same
+    snapshot, so the count always matches the rows that are read, and the
+    rows are still sent as they are read instead of after all of them.
+    '''
+    # the isolation level can only be set before the first query of a<br>
+    # transaction, so end the one the ETag was read in (it only read)
+    db.session.rollback()
+    db.session.connection(
+        execution_options={'isolation_level': 'REPEATABLE READ'})
+    total = query.order_by(None).count()
+    rows = query.yield_per(STREAM_BATCH_SIZE)
+
+    def generate():
+        packer = msgpack_packer()
+        yield (packer.pack_map_header(4 if count_name else 3)
+               + packer.pack('success') + packer.pack(True)
+               + packer.pack('status_code') + packer.pack(200)
+               + packer.pack(name) + packer.pack_array_header(total))
+        batch = []
+        for row in rows:
+            batch.append(packer.pack(format_row(row)))
+            if len(batch) == STREAM_BATCH_SIZE:
+                yield b''.join(batch)
+                batch = []
+        if batch:
+            yield b''.join(batch)
+        if count_name:
+            yield packer.pack(count_name) + packer.pack(total)
+
+    return Response(stream_with_context(generate()),
+                    mimetype=MSGPACK_MIMETYPE)
+
+
+def get_bulk_records():
+    # bulk endpoints expect a non empty JSON array of records
+    records = get_request_body(list)
+    if not records:
+        abort(400)
+    if len(records) > MAX_BULK_SIZE:
+        abort(400)
+    return records
+
+
+def integer_range(column_type):
+    # smallest and largest value of a Postgres integer column type
+    if isinstance(column_type, db.BigInteger):
+        bits = 64
+    elif isinstance(column_type, db.SmallInteger):
+        bits = 16
+    else:
+        bits = 32
+    return -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+
+def check_record(record, model, fields):
+    '''
+    Validate the required 'fields' of a bulk record against the column types
+    of 'model'. Returns an error message, or None if the record is valid.
+    A value the column can not hold would fail the statement of the whole
+    batch, so it is rejected here with its record.
+    '''
+    if not isinstance(record, dict):
+        return 'record must be an object'
+    for field in fields:
+        value = record.get(field)
+        if value is None:
+            return "missing '{}'".format(field)
+        column_type = getattr(model, field).type
+        if isinstance(column_type, db.String):
+            if not isinstance(value, str):
+                return "'{}' must be a string".format(field)
+            if column_type.length and len(value) > column_type.length:
+                return "'{}' is longer than {} characters".format(
+                    field, column_type.length)
+        elif isinstance(column_type, db.Integer):
+            if not isinstance(value, int) or isinstance(value, bool):
+                return "'{}' must be an integer".format(field)
+            low, high = integer_range(column_type)
+            if not low <= value <= high:
+                return "'{}' is out of range".format(field)
+    return None
+
+
+def valid_count(value, minimum=0):
+    # True if 'value' is an integer (not a bool) of at least 'minimum'<br>
+    # that fits an integer column
+    return (isinstance(value, int) and not isinstance(value, bool)
+            and minimum <= value <= integer_range(db.Integer())[1])
+
+
+def bulk_insert(model, rows, unique_column=None):
+    '''
+    Insert 'rows' with multi-row INSERT ... RETURNING statements in the
+    current transaction and return the new ids in the order of 'rows'.
+    Rows that conflict on 'unique_column' are skipped and get an id of None.
+    '''
+    table = model.__table__
+    ids = []
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+        statement = postgresql.insert(table).values(chunk)
+        if unique_column is None:
+            result = db.session.execute(statement.returning(table.c.id))
+            ids.extend(row.id for row in result)
+        else:
+            # ON CONFLICT DO NOTHING only returns the rows it inserted
+            statement = statement.on_conflict_do_nothing(
+                index_elements=[unique_column]).returning(
+                table.c.id, table.c[unique_column])
+            inserted = {row[1]: row[0]
+                        for row in db.session.execute(statement)}
+            ids.extend(inserted.get(row[unique_column]) for row in chunk)
+    return ids
+
+
+# revenue reports
+
+# columns each revenue report is grouped by, besides the aggregates.<br>
+# Reports by item, brand and day read the daily sales rollup, reports by<br>
+# customer the orders
+REPORT_GROUPS = {
+    'customer': lambda: [Orders.customer_id,
+                         Customer.name.label('customer_name')],
+    'item': lambda: [DailySales.item_id, Item.name.label('item_name')],
+    'brand': lambda: [Item.brand],
+    'day': lambda: [DailySales.day]
+}
+
+
+def get_date_range():
+    '''
+    Parse the date range of a report request: ?start=YYYY-MM-DD and
+    ?end=YYYY-MM-DD, both optional and both included in the range.
+    '''
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = date.fromisoformat(start) if start else None
+        end = date.fromisoformat(end) if end else None
+    except ValueError:
+        abort(400)
+    if start is not None and end is not None and start > end:
+        abort(400)
+    return start, end
+
+
+def revenue_report(group_by, start=None, end=None):
+    '''
+    Revenue (sum of amount_due), quantity and number of orders per
+    'group_by' value between 'start' and 'end', computed by the database in
+    one GROUP BY query. Reports by item, brand or day add up the rows of
+    the daily sales rollup (one per day and item), the customer report
+    aggregates the orders themselves.
+    '''
+    columns = REPORT_GROUPS[group_by]()
+    if group_by == 'customer':
+        query = db.session.query(
+            *columns,
+            db.func.coalesce(db.func.sum(Orders.amount_due), 0).label(
+                'revenue'),
+            db.func.coalesce(db.func.sum(Orders.quantity), 0).label(
+                'quantity'),
+            db.func.count(Orders.id).label('num_orders')).outerjoin(
+            Customer, Orders.customer_id == Customer.id)
+        # compare order_date with whole days, so that its index is used
+        if start is not None:
+            query = query.filter(Orders.order_date >= start)
+        if end is not None:
+            query = query.filter(
+                Orders.order_date < end + timedelta(days=1))
+    else:
+        # sums of bigint columns are numeric in Postgres, cast back to<br>
+        # integers for the JSON response
+        query = db.session.query(
+            *columns,
+            db.cast(db.func.sum(DailySales.revenue),
+                    db.BigInteger).label('revenue'),
+            db.cast(db.func.sum(DailySales.quantity),
+                    db.BigInteger).label('quantity'),
+            db.cast(db.func.sum(DailySales.num_orders),
+                    db.BigInteger).label('num_orders')).filter(
+            DailySales.num_orders > 0)
+        if group_by != 'day':
+            query = query.outerjoin(Item, DailySales.item_id == Item.id)
+        if start is not None:
+            query = query.filter(DailySales.day >= start)
+        if end is not None:
+            query = query.filter(DailySales.day <= end)
+    query = query.group_by(*columns)
+    # days in order, the other groups by revenue
+    if group_by == 'day':
+        return query.order_by(columns[0]).all()
+    return query.order_by(db.desc('revenue'), *columns).all()
+
+
+def format_report_row(row):
+    report_row = row._asdict()
+    if 'day' in report_row and report_row['day'] is not None:
+        report_row['day'] = report_row['day'].isoformat()
+    return report_row
+
+
+# settings read from the environment by create_app()
+REQUIRED_SETTINGS = ('DATABASE_URL', 'AUTH0_DOMAIN', 'ALGORITHMS',
+                     'API_AUDIENCE')
+OPTIONAL_SETTINGS = ('JWKS_URL', 'JSON_BACKEND')
+
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    # read the settings now rather than at import, 'test_config' overrides<br>
+    # the environment
+    config = dict(test_config or {})
+    for name in REQUIRED_SETTINGS:
+        if name not in config:
+            config[name] = os.environ[name]
+    for name in OPTIONAL_SETTINGS:
+        config.setdefault(name, os.environ.get(name))
+    app.config.from_mapping(config)
+    setup_db(app, app.config['DATABASE_URL'])
+    configure_auth(app.config['AUTH0_DOMAIN'], app.config['ALGORITHMS'],
+                   app.config['API_AUDIENCE'], app.config['JWKS_URL'])
     CORS(app)
+    # JSON encoder of the responses (orjson when it is installed)
+    init_serialization(app)
+    # request latency, status code and database query metrics
+    init_metrics(app)
+    # gzip or brotli compression of large and streamed responses
+    init_compression(app)
 
     # CUSTOMER ENDPOINTS
 
@@ -19,8 +486,25 @@ def create_app(test_config=None):
     # add permission decorator
     @requires_auth('get:customers')
     def get_customers():
-        # get all customers in database
-        customers = Customer.query.all()
+        # answer with 304 Not Modified if the customers did not change
+        etag = list_etag('customer')
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        # select only the columns of the requested ?fields= and apply<br>
+        # the ?q= search in the database
+        fields = get_fields(CUSTOMER_FIELDS)
+        format_customer = format_fields(fields)
+        customers_query = filter_customers(db.session.query(
+            *select_fields(CUSTOMER_FIELDS, fields)))
+        # stream all customers for exports
+        if stream_requested():
+            response = stream_list('customers', customers_query, Customer.id,
+                                   format_customer)
+            response.set_etag(etag)
+            return response
+        # get one page of customers from the database
+        customers, next_cursor = paginate(customers_query, Customer.id)
         # confirm that there are customers
         if customers is None:
             abort(404)
@@ -28,21 +512,22 @@ def create_app(test_config=None):
         customer_list = []
         # loop through queried customers and append info to customer_list
         for customer in customers:
-            customer_list.append(
-                {'id': customer.id, 'name': customer.name,
-                 'email': customer.email})
+            customer_list.append(format_customer(customer))
 
-        return jsonify({
+        response = jsonify({
             'success': True,
             'status_code': 200,
-            'customers': customer_list
+            'customers': customer_list,
+            'next_cursor': next_cursor
         })
+        response.set_etag(etag)
+        return response
 
     @app.route('/new_customer', methods=['POST'])
     @requires_auth('post:customer')
     def create_customer():
         # parse the JSON data included in request
-        data = request.get_json()
+        data = get_request_body()
         # assign todays date to 'today' variable
         today = date.today()
         # verify that data includes the correct info
@@ -68,12 +553,52 @@ def create_app(test_config=None):
             'customer': customer.name
         })
 
+    @app.route('/customers/bulk', methods=['POST'])
+    @requires_auth('post:customer')
+    def create_customers_bulk():
+        # parse the JSON array of customers included in request
+        records = get_bulk_records()
+        today = date.today()
+        rows = []
+        row_indexes = []
+        errors = []
+        # validate all records in one pass, invalid records are reported<br>
+        # without aborting the rest of the batch
+        for index, record in enumerate(records):
+            error = check_record(record, Customer, ('name', 'email'))
+            if error:
+                errors.append({'index': index, 'error': error})
+                continue
+            rows.append({'name': record['name'], 'email': record['email'],
+                         'join_date': today})
+            row_indexes.append(index)
+        # insert all valid customers in one transaction
+        try:
+            ids = bulk_insert(Customer, rows)
+            bump_version('customer')
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            print('Exception:', exc)
+            abort(422)
+
+        created = [{'index': index, 'id': id}
+                   for index, id in zip(row_indexes, ids)]
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'created': created,
+            'errors': errors,
+            'num_created': len(created),
+            'num_errors': len(errors)
+        })
+
     # include customer to be updated id in http request
     @app.route('/update_customer/<int:id>', methods=['PATCH'])
     @requires_auth('patch:customer')
     # pass id to be updated into function
     def update_customer(id):
-        data = request.get_json()
+        data = get_request_body()
         # query customer from database by 'id'
         customer = Customer.query.filter_by(id=id).one_or_none()
         # verify that customer exists
@@ -123,15 +648,15 @@ def create_app(test_config=None):
             db.session.rollback()
             print('Exception:', exc)
             abort(422)
-        # select remaining customers
-        customers = customer.query.all()
+        # count remaining customers
+        num_of_remaining_customers = count_rows(Customer.id)
 
         return jsonify({
             'success': True,
             'status_code': 200,
             'deleted_id': customer.id,
             'deleted_customer': customer.name,
-            'num_of_remaining_customers': len(customers)
+            'num_of_remaining_customers': num_of_remaining_customers
         })
 
     # ITEM ENDPOINTS
@@ -139,36 +664,69 @@ def create_app(test_config=None):
     @app.route('/items')
     @requires_auth('get:items')
     def get_items():
-        # select all items
-        items = Item.query.all()
+        # answer with 304 Not Modified if the items did not change
+        versions = get_versions('item')
+        etag = list_etag('item', versions=versions)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        fields = get_fields(ITEM_FIELDS)
+        format_item = format_fields(fields)
+        # stream all items for exports, selecting only the columns of<br>
+        # the requested ?fields=
+        if stream_requested():
+            response = stream_list(
+                'items', filter_items(db.session.query(
+                    *select_fields(ITEM_FIELDS, fields))),
+                Item.id, format_item)
+            response.set_etag(etag)
+            return response
+        # select the ids of one page of the items matching the filters,<br>
+        # the item data is served from the item catalog cache (entries<br>
+        # older than the version of the ETag are loaded again)
+        item_ids, next_cursor = paginate(
+            filter_items(db.session.query(Item.id)), Item.id)
         # verify that items exist
-        if items is None:
+        if item_ids is None:
             abort(404)
+        # ?fields=id is answered by the page query alone
+        if fields == ['id']:
+            items = {row.id: row for row in item_ids}
+        else:
+            items = item_catalog.get_many([row.id for row in item_ids],
+                                          versions['item'])
         # empty list to append items to
         item_list = []
-        # loop through selected items and append info to item_list
-        for item in items:
-            item_list.append({'id': item.id, 'name': item.name,
-                              'brand': item.brand, 'price': item.price})
+        # loop through selected items and append info to item_list<br>
+        # (skipping items deleted since their id was selected)
+        for row in item_ids:
+            if row.id in items:
+                item_list.append(format_item(items[row.id]))
 
-        return jsonify({
+        response = jsonify({
             'success': True,
             'status_code': 200,
-            'items': item_list
+            'items': item_list,
+            'next_cursor': next_cursor
         })
+        response.set_etag(etag)
+        return response
 
     @app.route('/new_item', methods=['POST'])
     @requires_auth('post:item')
     def create_item():
         # get JSON data
-        data = request.get_json()
+        data = get_request_body()
         # verify that data includes correct fields
         if (data.get('name') is None or data.get('brand') is None
                 or data.get('price') is None):
             abort(400)
+        # the optional stock must be a count of units
+        if data.get('stock') is not None and not valid_count(data['stock']):
+            abort(400)
         # create item to be inserted
-        item = Item(name=data['name'],
-                    brand=data['brand'], price=data['price'])
+        item = Item(name=data['name'], brand=data['brand'],
+                    price=data['price'], stock=data.get('stock'))
         # attempt to insert item
         try:
             item.insert()
@@ -184,11 +742,66 @@ def create_app(test_config=None):
             'item': item.name
         })
 
+    @app.route('/items/bulk', methods=['POST'])
+    @requires_auth('post:item')
+    def create_items_bulk():
+        # parse the JSON array of items included in request
+        records = get_bulk_records()
+        rows = []
+        row_indexes = []
+        errors = []
+        names = set()
+        # validate all records in one pass, invalid records are reported<br>
+        # without aborting the rest of the batch
+        for index, record in enumerate(records):
+            error = check_record(record, Item, ('name', 'brand', 'price'))
+            # item names are unique
+            if error is None and record['name'] in names:
+                error = 'duplicate item name'
+            if (error is None and record.get('stock') is not None
+                    and not valid_count(record['stock'])):
+                error = "'stock' must be a non-negative integer"
+            if error:
+                errors.append({'index': index, 'error': error})
+                continue
+            names.add(record['name'])
+            rows.append({'name': record['name'], 'brand': record['brand'],
+                         'price': record['price'], 'available': True,
+                         'stock': record.get('stock')})
+            row_indexes.append(index)
+        # insert all valid items in one transaction, items whose name<br>
+        # already exists are skipped
+        try:
+            ids = bulk_insert(Item, rows, unique_column='name')
+            bump_version('item')
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            print('Exception:', exc)
+            abort(422)
+
+        created = []
+        for index, id in zip(row_indexes, ids):
+            if id is None:
+                errors.append({'index': index,
+                               'error': 'duplicate item name'})
+            else:
+                created.append({'index': index, 'id': id})
+        errors.sort(key=lambda error: error['index'])
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'created': created,
+            'errors': errors,
+            'num_created': len(created),
+            'num_errors': len(errors)
+        })
+
     @app.route('/update_item/<int:id>', methods=['PATCH'])
     @requires_auth('patch:item')
     # include item to be updated 'id' in http request and pass into function
     def update_item(id):
-        data = request.get_json()
+        data = get_request_body()
         # assign object to be updated to 'item' variable
         item = Item.query.filter_by(id=id).one_or_none()
         # veify that item exists
@@ -196,7 +809,10 @@ def create_app(test_config=None):
             abort(404)
         # verify that update data includes correct data
         if (data.get('name') is None and data.get('brand') is None
-                and data.get('price') is None):
+                and data.get('price') is None and 'stock' not in data):
+            abort(400)
+        # a stock of null stops tracking the stock of the item
+        if data.get('stock') is not None and not valid_count(data['stock']):
             abort(400)
         # check what fields are to be updated and assign updated fields<br>
         # to item object
@@ -208,6 +824,9 @@ def create_app(test_config=None):
 
         if data.get('price'):
             item.price = data['price']
+        # set the number of units in stock, e.g. after a delivery
+        if 'stock' in data:
+            item.stock = data['stock']
         # attempt to update item with .update() (see models.py)
         try:
             item.update()
@@ -221,7 +840,8 @@ def create_app(test_config=None):
             'status_code': 200,
             'item_name': item.name,
             'item_brand': item.brand,
-            'item_price': item.price
+            'item_price': item.price,
+            'item_stock': item.stock
         })
 
     @app.route('/delete_item/<int:id>', methods=['DELETE'])
@@ -241,15 +861,15 @@ def create_app(test_config=None):
             db.session.rollback()
             print('Exception:', exc)
             abort(422)
-        # query remaining items
-        items = Item.query.all()
+        # count remaining items
+        num_of_remaining_items = count_rows(Item.id)
 
         return jsonify({
             'success': True,
             'status_code': 200,
             'deleted_id': id,
             'deleted_item': deleted_name,
-            'num_of_remaining_items': len(items)
+            'num_of_remaining_items': num_of_remaining_items
         })
 
     # ORDER endpoints
@@ -257,57 +877,102 @@ def create_app(test_config=None):
     @app.route('/orders')
     @requires_auth('get:orders')
     def get_orders():
-        # select all orders from database
-        orders = Orders.query.all()
+        # the order list includes customer and item names, so it changes<br>
+        # with any of the three tables
+        etag = list_etag('orders', 'customer', 'item')
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        '''select the order columns together with the customer and item
+        names in one joined query, instead of loading them through the
+        lazy 'customer' and 'item' backrefs (see models.py) which would
+        issue two extra SELECTs per order. Only the columns of the
+        requested ?fields= are selected, and a name is only joined in
+        when it was requested'''
+        fields = get_fields(ORDER_FIELDS)
+        format_order = format_fields(fields)
+        orders_query = db.session.query(
+            *select_fields(ORDER_FIELDS, fields)).select_from(Orders)
+        if 'customer_name' in fields:
+            orders_query = orders_query.outerjoin(
+                Customer, Orders.customer_id == Customer.id)
+        if 'item_name' in fields:
+            orders_query = orders_query.outerjoin(
+                Item, Orders.item_id == Item.id)
+        # stream all orders for exports
+        if stream_requested():
+            response = stream_list('orders_list', orders_query, Orders.id,
+                                   format_order, count_name='num_of_orders')
+            response.set_etag(etag)
+            return response
+        # select one page of orders from database
+        orders, next_cursor = paginate(orders_query, Orders.id)
         # verify that orders exist
         if orders is None:
             abort(404)
         # create empty list to append orders to
         orders_list = []
-        '''loop through orders and append them to orders_list (appended
-        data includes data from the Customer and Item tables which was made
-        possible by declaring a relationship between the Orders and Customer
-        and Item tables (see models.py from implementation))'''
+        # loop through orders and append them to orders_list
         for order in orders:
-            orders_list.append({'id': order.id,
-                                'order_date': order.order_date,
-                                'customer_name': order.customer.name,
-                                'item_name': order.item.name,
-                                'quantity': order.quantity})
+            orders_list.append(format_order(order))
 
-        return jsonify({
+        response = jsonify({
             'success': True,
             'status_code': 200,
             'orders_list': orders_list,
-            'num_of_orders': len(orders)
+            'num_of_orders': len(orders),
+            'next_cursor': next_cursor
         })
+        response.set_etag(etag)
+        return response
 
     @app.route('/submit_order', methods=['POST'])
     @requires_auth('post:order')
     def submit_order():
         # get request JSON data
-        data = request.get_json()
+        data = get_request_body()
         # verify that data contains the correct info
         if (data.get('customer_id') is None or data.get('item_id') is None
                 or data.get('quantity') is None):
             abort(404)
-        # select item to be added to order
-        item = Item.query.filter_by(id=data['item_id']).one_or_none()
-        if item is None:
+        # the quantity is a number of units taken out of stock
+        if not valid_count(data['quantity'], 1):
+            abort(400)
+        try:
+            item_id = int(data['item_id'])
+        except (TypeError, ValueError):
             abort(404)
-        # verify that item is available
-        if item.available is False:
-            abort(422, 'item not available')
+        '''take the units out of stock and read the price with one
+        conditional UPDATE (see reserve_stock in models.py) instead of
+        checking the item first, so that two concurrent orders can not
+        both pass the check for the last units'''
+        try:
+            price = reserve_stock(item_id, data['quantity'])
+        except Exception as exc:
+            db.session.rollback()
+            print('Exception:', exc)
+            abort(422)
+        if price is None:
+            db.session.rollback()
+            # find out why the item could not be reserved
+            item = db.session.query(Item.available).filter(
+                Item.id == item_id).one_or_none()
+            if item is None:
+                abort(404)
+            if item.available is False:
+                abort(422, 'item not available')
+            abort(422, 'insufficient stock')
         # get todays date
         today = date.today()
         # calculate total price of order based upon item price<br>
         # and quantity of order
-        total_price = item.price * data['quantity']
+        total_price = price * data['quantity']
         # create orders object
         order = Orders(order_date=today, customer_id=data['customer_id'],
-                       item_id=data['item_id'], quantity=data['quantity'],
+                       item_id=item_id, quantity=data['quantity'],
                        amount_due=total_price)
-        # attempt to insert order into database with .insert() (see models.py)
+        # insert the order in the transaction of the reservation, which<br>
+        # commits both (or neither) with .insert() (see models.py)
         try:
             order.insert()
         except Exception as exc:
@@ -315,34 +980,124 @@ def create_app(test_config=None):
             print('Exception:', exc)
             abort(422)
 
-        return ({
+        return jsonify({
             'success': True,
             'status_code': 200,
             'order_id': order.id
         })
 
+    @app.route('/orders/bulk', methods=['POST'])
+    @requires_auth('post:order')
+    def submit_orders_bulk():
+        # parse the JSON array of orders included in request
+        records = get_bulk_records()
+        errors = []
+        valid = []
+        # validate all records in one pass
+        for index, record in enumerate(records):
+            error = check_record(record, Orders,
+                                 ('customer_id', 'item_id', 'quantity'))
+            if error is None and record['quantity'] < 1:
+                error = "'quantity' must be positive"
+            if error:
+                errors.append({'index': index, 'error': error})
+            else:
+                valid.append((index, record))
+        # check which referenced customers exist with one IN (...) query
+        customer_ids = {record['customer_id'] for _, record in valid}
+        existing_customer_ids = set()
+        if valid:
+            existing_customer_ids = {customer.id for customer in
+                                     db.session.query(Customer.id).filter(
+                                         Customer.id.in_(customer_ids))}
+        today = date.today()
+        accepted = []
+        quantities = {}
+        # the units of an item are reserved with one integer parameter
+        _, max_quantity = integer_range(Item.stock.type)
+        # reject the orders of unknown customers before taking any stock
+        for index, record in valid:
+            item_id = record['item_id']
+            quantity = quantities.get(item_id, 0) + record['quantity']
+            if record['customer_id'] not in existing_customer_ids:
+                errors.append({'index': index,
+                               'error': 'customer not found'})
+            elif quantity > max_quantity:
+                errors.append({'index': index,
+                               'error': "'quantity' is out of range"})
+            else:
+                accepted.append((index, record))
+                quantities[item_id] = quantity
+        # take the units of all orders out of stock and insert the<br>
+        # orders of the reserved items in one transaction, priced with<br>
+        # the prices the reservation read from the locked item rows
+        try:
+            # the orders of an item are reserved all or nothing
+            prices, reasons = reserve_stock_many(quantities)
+            rows = []
+            row_indexes = []
+            for index, record in accepted:
+                item_id = record['item_id']
+                if item_id not in prices:
+                    errors.append({'index': index,
+                                   'error': reasons[item_id]})
+                    continue
+                rows.append({'order_date': today,
+                             'customer_id': record['customer_id'],
+                             'item_id': item_id,
+                             'quantity': record['quantity'],
+                             'amount_due': (prices[item_id]
+                                            * record['quantity'])})
+                row_indexes.append(index)
+            ids = bulk_insert(Orders, rows)
+            if ids:
+                add_daily_sales(Orders.id.in_(ids))
+            bump_version('orders')
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            print('Exception:', exc)
+            abort(422)
+
+        created = [{'index': index, 'order_id': id}
+                   for index, id in zip(row_indexes, ids)]
+        errors.sort(key=lambda error: error['index'])
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'created': created,
+            'errors': errors,
+            'num_created': len(created),
+            'num_errors': len(errors)
+        })
+
     @app.route('/delete_order/<int:id>', methods=['DELETE'])
     @requires_auth('delete:order')
     def delete_order(id):
-        # select rder to be deleted from database
-        order = Orders.query.filter_by(id=id).one_or_none()
-        # verify that order exists
-        if order is None:
-            abort(404)
-        # get previous number of orders
-        previous_num_of_orders = len(Orders.query.all())
-        # attempt to delete order with .delete() (see models.py)
+        '''delete the order with a single DELETE statement, which also
+        takes it out of the daily sales rollup. Its rowcount tells whether
+        the order existed, and the remaining orders are counted by the
+        database in the same transaction'''
         try:
-            order.delete()
+            num_of_deleted_orders = delete_orders(Orders.id == id)
+            # get number of current orders
+            current_num_of_orders = count_rows(Orders.id)
+            # the orders list only changes if the order existed
+            if num_of_deleted_orders > 0:
+                bump_version('orders')
+            db.session.commit()
         except Exception as exc:
             db.session.rollback()
             print('Exception:', exc)
             abort(422)
-        # get number of current orders
-        current_num_of_orders = len(Orders.query.all())
+        # verify that order existed
+        if num_of_deleted_orders == 0:
+            abort(404)
+        # get previous number of orders
+        previous_num_of_orders = current_num_of_orders + num_of_deleted_orders
 
         # check that order has been deleted before returning
-        if (current_num_of_orders) == (previous_num_of_orders - 1):
+        if num_of_deleted_orders == 1:
             return jsonify({
                 'success': True,
                 'status_code': 200,
@@ -355,12 +1110,67 @@ def create_app(test_config=None):
         else:
             abort(500, 'Order was not deleted')
 
+    # REPORTS
+
+    # revenue, quantity and number of orders per customer, item, brand or
+    # day, optionally between ?start= and ?end= (YYYY-MM-DD)
+
+    @app.route('/reports/revenue/<group_by>')
+    @requires_auth('get:orders')
+    def get_revenue_report(group_by):
+        if group_by not in REPORT_GROUPS:
+            abort(404)
+        start, end = get_date_range()
+        # the report changes with orders and with customer and item names
+        etag = '{}-{}-{}-{}'.format(
+            group_by, start, end, list_etag('orders', 'customer', 'item'))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        # only the aggregated rows are read from the database
+        rows = revenue_report(group_by, start, end)
+
+        response = jsonify({
+            'success': True,
+            'status_code': 200,
+            'group_by': group_by,
+            'start': start.isoformat() if start else None,
+            'end': end.isoformat() if end else None,
+            'revenue_list': [format_report_row(row) for row in rows],
+            'num_of_rows': len(rows)
+        })
+        response.set_etag(etag)
+        return response
+
+    # CACHE STATISTICS
+
+    @app.route('/cache_stats')
+    @requires_auth('get:items')
+    def get_cache_stats():
+        # size, hits, misses and hit rate of the in-process caches
+        return jsonify({
+            'success': True,
+            'status_code': 200,
+            'item_catalog': item_catalog.stats(),
+            'token_cache': token_cache.stats()
+        })
+
+    # METRICS
+
+    @app.route('/metrics')
+    def get_metrics():
+        # prometheus text exposition of the request, auth and database<br>
+        # metrics of all workers
+        return Response(generate_metrics(), content_type=CONTENT_TYPE_LATEST)
+
     # ERROR HANDLERS
 
     # error handler for auth0
 
     @app.errorhandler(AuthError)
     def handle_auth_error(ex):
+        # count auth errors by their code (e.g. token_expired)
+        set_error(ex.error['code'])
         response = jsonify(ex.error)
         response.status_code = ex.status_code
         return response
@@ -400,7 +1210,5 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
-
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
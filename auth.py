@@ -1,14 +1,40 @@
 import os
 import json
+import time
+import hashlib
+import threading
 from flask import request, _request_ctx_stack
 from functools import wraps
-from jose import jwt
+from jose import jwt, jwk
 from urllib.request import urlopen
+from cache import SharedCache, TTLCache
+from metrics import JWT_VERIFY_LATENCY
 
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
-ALGORITHMS = os.environ['ALGORITHMS']
-API_AUDIENCE = os.environ['API_AUDIENCE']
+def parse_algorithms(value):
+    # accepts 'RS256', 'RS256,RS384' or a list literal such as "['RS256']"
+    algorithms = []
+    for algorithm in value.strip().strip('[]').split(','):
+        algorithm = algorithm.strip().strip('\'"')
+        if algorithm:
+            algorithms.append(algorithm)
+    return algorithms
+
+
+# Auth0 settings, set by configure() when the app is created
+AUTH0_DOMAIN = None
+ALGORITHMS = ['RS256']
+API_AUDIENCE = None
+# seconds a fetched key set is considered fresh
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 3600))
+# seconds before expiry at which a background refresh is started
+JWKS_REFRESH_AHEAD = int(os.environ.get('JWKS_REFRESH_AHEAD', 300))
+# minimum seconds between refetches forced by an unknown 'kid'
+JWKS_MIN_REFETCH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFETCH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+# maximum number of verified tokens kept in memory
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
 
 '''
 AuthError Exception
@@ -22,6 +48,205 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+# JWKS key store
+
+def construct_key(key):
+    '''
+    Build the python-jose key object for a JWK once, so that jwt.decode
+    does not have to rebuild it from 'n' and 'e' on every request.
+    '''
+    algorithm = key.get('alg') or ALGORITHMS[0]
+    return jwk.construct({
+        'kty': key['kty'],
+        'kid': key['kid'],
+        'use': key.get('use'),
+        'n': key['n'],
+        'e': key['e']
+    }, algorithm)
+
+
+def parse_jwks(jwks):
+    # map each RSA signing key in a key set to its constructed key
+    keys = {}
+    for key in jwks['keys']:
+        if (key.get('kty') != 'RSA' or 'kid' not in key
+                or key.get('use', 'sig') != 'sig'):
+            continue
+        try:
+            keys[key['kid']] = construct_key(key)
+        except Exception as exc:
+            print('Exception:', exc)
+    return keys
+
+
+class JWKSKeyStore:
+    '''
+    In-process cache of the signing keys published at 'url'.
+    The key set is fetched once, each entry is turned into a ready-to-use
+    public key object and the keys are served from memory by 'kid'.
+    Shortly before the TTL runs out a background thread refreshes it, an
+    unknown 'kid' forces a (rate limited) refetch, and if a refresh fails
+    the last good key set keeps being served.
+    '''
+
+    def __init__(self, url, ttl=JWKS_TTL, refresh_ahead=JWKS_REFRESH_AHEAD,
+                 min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT, shared=None):
+        self.url = url
+        # optional SharedCache through which workers share the fetched<br>
+        # key set, so that it is downloaded once rather than per worker
+        self.shared = shared
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        # kid -> public key object of the last key set that was fetched<br>
+        # successfully
+        self.keys = {}
+        self.fetched_at = None
+        self.last_attempt = None
+        self.last_error = None
+        self.fetch_count = 0
+        self._lock = threading.Lock()
+        # held while the first key set is loaded
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self, force=False):
+        # use the key set another worker fetched, unless a refetch is forced
+        jwks = None
+        if self.shared is not None and not force:
+            jwks = self.shared.get('keys')
+        # download and parse the key set
+        if jwks is None:
+            jsonurl = urlopen(self.url, timeout=self.timeout)
+            jwks = json.loads(jsonurl.read())
+            if self.shared is not None:
+                self.shared.set('keys', jwks)
+        return parse_jwks(jwks)
+
+    def refresh(self, force=False):
+        # fetch the key set, keeping the previous one if the fetch fails
+        self.last_attempt = time.monotonic()
+        self.fetch_count += 1
+        try:
+            keys = self._fetch(force)
+        except Exception as exc:
+            self.last_error = exc
+            print('Exception:', exc)
+            return False
+        with self._lock:
+            self.keys = keys
+            self.fetched_at = time.monotonic()
+            self.last_error = None
+        return True
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def _start_background_refresh(self):
+        # only one refresh thread at a time, and no more often than the<br>
+        # refetch interval allows while the provider keeps failing
+        with self._lock:
+            if self._refreshing or not self._may_refetch():
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._background_refresh,
+                                  daemon=True)
+        thread.start()
+
+    def _may_refetch(self):
+        return (self.last_attempt is None or
+                time.monotonic() - self.last_attempt >=
+                self.min_refetch_interval)
+
+    def get_key(self, kid):
+        # first use blocks until a key set has been loaded, concurrent<br>
+        # first requests wait for the one loading it
+        if self.fetched_at is None:
+            with self._load_lock:
+                if self.fetched_at is None and self._may_refetch():
+                    self.refresh()
+            if self.fetched_at is None:
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch signing keys.'
+                }, 503)
+        # stale-while-revalidate: keep serving the current set while a<br>
+        # background refresh runs once it is close to (or past) its TTL
+        elif (time.monotonic() - self.fetched_at >=
+              self.ttl - self.refresh_ahead):
+            self._start_background_refresh()
+
+        key = self.keys.get(kid)
+        # unknown kid: the provider may have rotated its keys
+        if key is None and self._may_refetch():
+            self.refresh(force=True)
+            key = self.keys.get(kid)
+        return key
+
+
+# key store of the configured JWKS, set by configure()
+jwks_store = None
+
+
+def configure(domain, algorithms, audience, jwks_url=None):
+    '''
+    Set the Auth0 tenant, the accepted algorithms ('RS256', 'RS256,RS384'
+    or "['RS256']") and the API audience tokens are verified against.
+    'jwks_url' defaults to the key set of the tenant but can point at a
+    local file (file:///path/jwks.json) or stub server for testing. Called
+    by create_app(), nothing is read from the environment at import.
+    '''
+    global AUTH0_DOMAIN, ALGORITHMS, API_AUDIENCE, jwks_store
+    AUTH0_DOMAIN = domain
+    # parsed once instead of being handed to jwt.decode as a string
+    ALGORITHMS = parse_algorithms(algorithms)
+    API_AUDIENCE = audience
+    jwks_url = jwks_url or f'https://{domain}/.well-known/jwks.json'
+    # keep the loaded key set when an app is created again for the same<br>
+    # key set (e.g. once per test)
+    if jwks_store is None or jwks_store.url != jwks_url:
+        # shared copies of the key set expire when the background refresh<br>
+        # is due
+        jwks_store = JWKSKeyStore(jwks_url, shared=SharedCache(
+            'jwks', 1, max(JWKS_TTL - JWKS_REFRESH_AHEAD, 1)))
+
+
+# Verified token cache
+
+class TokenCache(TTLCache):
+    '''
+    Bounded LRU cache of decoded payloads of tokens that passed
+    verify_decode_jwt. Entries are keyed by a hash of the token (the raw
+    token is never stored) and expire together with the token's 'exp'.
+    '''
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        # 'exp' is a unix timestamp, so entries expire by the wall clock
+        super().__init__(max_size, clock=time.time)
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        return super().get(self._key(token))
+
+    def set(self, token, payload):
+        # tokens without an expiry are never cached
+        exp = payload.get('exp')
+        if not isinstance(exp, (int, float)):
+            return
+        super().set(self._key(token), payload, expires_at=exp)
+
+
+token_cache = TokenCache()
+
+
 # Auth Header
 
 def get_token_auth_header():
@@ -64,29 +289,21 @@ def check_permissions(permission, payload):
     return True
 
 
+@JWT_VERIFY_LATENCY.time()
 def verify_decode_jwt(token):
-    # gets signature verification from Auth0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    # gets the constructed signature verification key from the cached<br>
+    # Auth0 key set
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
+    if rsa_key is not None:
         try:
+            # python-jose uses a key object as it is
             payload = jwt.decode(
                 token,
                 rsa_key,
@@ -127,8 +344,12 @@ def requires_auth(permission=''):
         def wrapper(*args, **kwargs):
             # get authentication token
             token = get_token_auth_header()
-            # verify token
-            payload = verify_decode_jwt(token)
+            # verify token, unless it was already verified and has not<br>
+            # expired yet
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_decode_jwt(token)
+                token_cache.set(token, payload)
             # check if required permission exists in payload
             check_permissions(permission, payload)
             # return wrapped function
@@ -0,0 +1,102 @@
+'''
+Micro-benchmark of the per-request token verification cost.
+
+Compares the original verify_decode_jwt flow (walk the JWKS, build an
+rsa_key dict and let python-jose rebuild the public key from 'n'/'e' on
+every call) with the current one (constructed key looked up by 'kid').
+Runs offline against a locally generated key set.
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_auth [iterations]
+'''
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import timeit
+import tempfile
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+import auth
+
+
+def b64_int(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def make_key_set(num_keys=3):
+    # returns the private key of the last JWK and the JWKS itself
+    keys = []
+    for num in range(num_keys):
+        private_key = RSA.generate(2048)
+        keys.append({'kty': 'RSA', 'kid': 'key-{}'.format(num), 'use': 'sig',
+                     'n': b64_int(private_key.n),
+                     'e': b64_int(private_key.e)})
+    return private_key, {'keys': keys}
+
+
+def legacy_verify_decode_jwt(token, jwks):
+    # verify_decode_jwt as it was before keys were pre-parsed (without the
+    # JWKS download, which is already cached), including the ALGORITHMS
+    # environment string it handed to jwt.decode
+    unverified_header = jwt.get_unverified_header(token)
+    rsa_key = {}
+    for key in jwks['keys']:
+        if key['kid'] == unverified_header['kid']:
+            rsa_key = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+    return jwt.decode(token, rsa_key,
+                      algorithms="['RS256']",
+                      audience=auth.API_AUDIENCE,
+                      issuer='https://' + auth.AUTH0_DOMAIN + '/')
+
+
+def main(iterations=500):
+    private_key, jwks = make_key_set()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        jwks_path = os.path.join(tmp_dir, 'jwks.json')
+        with open(jwks_path, 'w') as jwks_file:
+            json.dump(jwks, jwks_file)
+        auth.configure('benchmark.auth0.com', "['RS256']", 'warehouse-api',
+                       'file://' + jwks_path)
+
+        token = jwt.encode({
+            'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+            'aud': auth.API_AUDIENCE,
+            'exp': int(time.time()) + 3600,
+            'permissions': ['get:items']
+        }, private_key.export_key().decode(), algorithm='RS256',
+            headers={'kid': jwks['keys'][-1]['kid']})
+        # load the key store before timing
+        auth.verify_decode_jwt(token)
+
+        results = {
+            'before': timeit.timeit(
+                lambda: legacy_verify_decode_jwt(token, jwks),
+                number=iterations),
+            'after': timeit.timeit(
+                lambda: auth.verify_decode_jwt(token), number=iterations)
+        }
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for name, total in results.items():
+        print('{:<8}{:>10.1f} us/request'.format(
+            name, total / iterations * 1e6))
+    print('speedup {:>10.2f}x'.format(results['before'] / results['after']))
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
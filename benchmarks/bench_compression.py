@@ -0,0 +1,123 @@
+'''
+Compression benchmark: CPU time against bytes saved for gzip levels and
+brotli qualities on seeded /customers and /orders responses, a full page
+and a streamed export of each. The bodies are fetched from the app
+uncompressed and then compressed as compression.py does, whole for the
+pages and chunk by chunk (one flush per chunk) for the exports.
+
+It needs a Postgres database, WHICH IS EMPTIED when it is seeded:
+
+    python -m benchmarks.bench_compression --orders 20000 --repeat 10
+'''
+import sys
+import json
+import time
+import argparse
+import statistics
+
+from benchmarks import harness
+
+# responses that are compressed
+URLS = ('/customers?limit=1000', '/orders?limit=1000',
+        '/customers?stream=true', '/orders?stream=true')
+# levels of every content coding
+LEVELS = {'gzip': (1, 3, 6, 9), 'br': (1, 4, 6, 11)}
+
+
+def fetch_body(client, url, token):
+    # the uncompressed chunks the app writes for 'url'
+    response = client.get(url, headers={'Authorization': token},
+                          buffered=False)
+    assert response.status_code == 200, response.status_code
+    chunks = [chunk for chunk in response.response]
+    response.close()
+    return chunks
+
+
+def measure(chunks, encoding, level, streamed, repeat):
+    # median seconds and compressed bytes of 'chunks'
+    from compression import create_compressor, compress
+    body = b''.join(chunks)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if streamed:
+            compressor = create_compressor(encoding, level)
+            size = sum(len(compressor.process(chunk) + compressor.flush())
+                       for chunk in chunks)
+            size += len(compressor.finish())
+        else:
+            size = len(compress(body, encoding, level))
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.bench_compression',
+        description='Response compression benchmark of the warehouse API.')
+    parser.add_argument('--database-url', help=(
+        'benchmark database, emptied and seeded (default: '
+        '$BENCH_DATABASE_URL or {})'.format(harness.DEFAULT_DATABASE_URL)))
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', default='bench_compression.json')
+    args = parser.parse_args(argv)
+
+    harness.prepare_environment(args.database_url)
+    import compression
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        harness.seed(db, customers=args.customers, items=500,
+                     orders=args.orders)
+    token = harness.sign_token()
+    client = app.test_client()
+    encodings = ['gzip'] + (['br'] if compression.brotli is not None
+                            else [])
+
+    results = {}
+    for url in URLS:
+        chunks = [chunk if isinstance(chunk, bytes)
+                  else chunk.encode('utf-8')
+                  for chunk in fetch_body(client, url, token)]
+        size = sum(len(chunk) for chunk in chunks)
+        results[url] = {'bytes': size, 'encodings': {}}
+        for encoding in encodings:
+            for level in LEVELS[encoding]:
+                seconds, compressed = measure(
+                    chunks, encoding, level, 'stream=true' in url,
+                    args.repeat)
+                results[url]['encodings']['{}-{}'.format(
+                    encoding, level)] = {
+                    'seconds': seconds, 'bytes': compressed,
+                    'ratio': compressed / size,
+                    'mb_per_second': size / seconds / 1e6}
+
+    report = {
+        'python': sys.version.split()[0],
+        'config': {'customers': args.customers, 'orders': args.orders,
+                   'repeat': args.repeat},
+        'responses': results
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    for url, result in results.items():
+        print('{} ({} bytes)'.format(url, result['bytes']))
+        print('    {:<10}{:>10}{:>12}{:>8}{:>10}'.format(
+            'encoding', 'ms', 'bytes', 'ratio', 'MB/s'))
+        for name, encoded in result['encodings'].items():
+            print('    {:<10}{:>10.2f}{:>12}{:>8.3f}{:>10.1f}'.format(
+                name, encoded['seconds'] * 1000, encoded['bytes'],
+                encoded['ratio'], encoded['mb_per_second']))
+    print('results written to {}'.format(args.output))
+    return report
+
+
+if __name__ == '__main__':
+    main()
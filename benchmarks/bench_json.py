@@ -0,0 +1,136 @@
+'''
+JSON encoder benchmark: encode time and size of seeded /orders payloads
+with Flask's stock encoder and with each JSON backend of serialization.py,
+and the end-to-end time of paged and streamed GET /orders requests with
+each backend.
+
+The payloads are built by the same query and formatting as the endpoint.
+It needs a Postgres database, WHICH IS EMPTIED when it is seeded:
+
+    python -m benchmarks.bench_json --orders 20000 --repeat 20
+'''
+import sys
+import json
+import time
+import argparse
+import statistics
+
+from benchmarks import harness
+
+# rows per payload: a default page, a full page and a large export
+PAYLOAD_SIZES = (100, 1000, 10000)
+
+
+def time_call(function, repeat):
+    # median seconds of 'repeat' calls of 'function'
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def order_payload(rows):
+    # the document GET /orders returns for 'rows'
+    from app import ORDER_FIELDS, format_fields
+    format_order = format_fields(list(ORDER_FIELDS))
+    return {'success': True, 'status_code': 200,
+            'orders_list': [format_order(row) for row in rows],
+            'num_of_orders': len(rows), 'next_cursor': None}
+
+
+def encoders(app):
+    # name -> function encoding a value to bytes, as the app would
+    from flask import json as flask_json
+    from serialization import create_json_backend, orjson
+    sort_keys = app.config['JSON_SORT_KEYS']
+    # flask.jsonify writes compact JSON outside of debug mode
+    result = {'flask': lambda value: flask_json.dumps(
+                  value, separators=(',', ':')).encode('utf-8'),
+              'json': create_json_backend('json', sort_keys).dumps}
+    if orjson is not None:
+        result['orjson'] = create_json_backend('orjson', sort_keys).dumps
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.bench_json',
+        description='JSON encoder benchmark of the warehouse API.')
+    parser.add_argument('--database-url', help=(
+        'benchmark database, emptied and seeded (default: '
+        '$BENCH_DATABASE_URL or {})'.format(harness.DEFAULT_DATABASE_URL)))
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default='bench_json.json')
+    args = parser.parse_args(argv)
+
+    harness.prepare_environment(args.database_url)
+    from app import create_app, ORDER_FIELDS
+    from models import db, Orders, Customer, Item
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        harness.seed(db, customers=1000, items=500, orders=args.orders)
+        rows = db.session.query(*ORDER_FIELDS.values()).outerjoin(
+            Customer, Orders.customer_id == Customer.id).outerjoin(
+            Item, Orders.item_id == Item.id).order_by(Orders.id).limit(
+            max(PAYLOAD_SIZES)).all()
+        payloads = {size: order_payload(rows[:size])
+                    for size in PAYLOAD_SIZES if size <= len(rows)}
+        encode = {}
+        for name, dumps in encoders(app).items():
+            encode[name] = {
+                size: {'seconds': time_call(lambda: dumps(payload),
+                                            args.repeat),
+                       'bytes': len(dumps(payload))}
+                for size, payload in payloads.items()}
+
+    # whole requests, including the query and the routing
+    token = harness.sign_token()
+    requests = {}
+    for name in encode:
+        if name == 'flask':
+            continue
+        backend_app = create_app({'JSON_BACKEND': name})
+        client = backend_app.test_client()
+        requests[name] = {}
+        for url in ('/orders?limit=1000', '/orders?stream=true'):
+            def get():
+                response = client.get(url, headers={'Authorization': token})
+                assert response.status_code == 200, response.status_code
+                return response.data
+            get()
+            requests[name][url] = {
+                'seconds': time_call(get, args.repeat),
+                'bytes': len(get())}
+
+    report = {
+        'python': sys.version.split()[0],
+        'config': {'orders': args.orders, 'repeat': args.repeat},
+        'encode': encode,
+        'requests': requests
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    print('{:<10}{:>8}{:>12}{:>12}'.format('encoder', 'rows', 'encode ms',
+                                           'bytes'))
+    for name, sizes in encode.items():
+        for size, result in sizes.items():
+            print('{:<10}{:>8}{:>12.2f}{:>12}'.format(
+                name, size, result['seconds'] * 1000, result['bytes']))
+    print('{:<10}{:<22}{:>12}{:>12}'.format('backend', 'request',
+                                            'median ms', 'bytes'))
+    for name, urls in requests.items():
+        for url, result in urls.items():
+            print('{:<10}{:<22}{:>12.2f}{:>12}'.format(
+                name, url, result['seconds'] * 1000, result['bytes']))
+    print('results written to {}'.format(args.output))
+    return report
+
+
+if __name__ == '__main__':
+    main()
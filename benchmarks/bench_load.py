@@ -0,0 +1,262 @@
+'''
+Load test of the API: seeds a benchmark database, serves create_app() from
+a threaded local HTTP server and drives a weighted mix of requests at it
+from concurrent clients. Reports the p50/p95/p99 latency and requests per
+second of every endpoint and writes them to a JSON file, so that runs can
+be compared across commits.
+
+Tokens are signed with a local key whose JWKS is served from a file, so the
+benchmark runs without an Auth0 tenant. It needs a Postgres database
+(the app uses Postgres specific statements), WHICH IS EMPTIED when it is
+seeded:
+
+    createdb warehouse_bench
+    python -m benchmarks.bench_load --mix mixed --concurrency 8 \\
+        --duration 30 --output bench_load.json
+
+Run with --help for all options.
+'''
+import sys
+import json
+import math
+import time
+import logging
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+
+from benchmarks import harness
+
+# request mixes: endpoint -> weight
+MIXES = {
+    'read': {'GET /items': 50, 'GET /orders': 50},
+    'mixed': {'GET /items': 35, 'GET /orders': 35, 'POST /submit_order': 15,
+              'PATCH /update_item': 5, 'PATCH /update_customer': 5,
+              'DELETE /delete_order': 5},
+    'write': {'POST /submit_order': 50, 'PATCH /update_item': 20,
+              'PATCH /update_customer': 15, 'DELETE /delete_order': 15}
+}
+
+
+class Workload:
+    '''
+    Builds the requests of the benchmark from the seeded ids. Orders are
+    deleted at most once, later deletes of the same mix get new order ids
+    only from the orders submitted during the run.
+    '''
+
+    def __init__(self, ids, page_size, random_seed):
+        self.ids = ids
+        self.page_size = page_size
+        self.rng = random.Random(random_seed)
+        self.deletable_orders = list(ids['orders'])
+        self.rng.shuffle(self.deletable_orders)
+        self._lock = threading.Lock()
+
+    def request(self, endpoint):
+        # returns (method, path, body) of one request to 'endpoint'
+        with self._lock:
+            rng = self.rng
+            if endpoint == 'GET /items':
+                return 'GET', '/items?limit={}'.format(self.page_size), None
+            if endpoint == 'GET /orders':
+                after = rng.choice(self.ids['orders'] or [0])
+                return 'GET', '/orders?limit={}&after={}'.format(
+                    self.page_size, after), None
+            if endpoint == 'POST /submit_order':
+                return 'POST', '/submit_order', {
+                    'customer_id': rng.choice(self.ids['customer']),
+                    'item_id': rng.choice(self.ids['item']),
+                    'quantity': rng.randint(1, 10)}
+            if endpoint == 'PATCH /update_item':
+                return 'PATCH', '/update_item/{}'.format(
+                    rng.choice(self.ids['item'])), {
+                    'price': rng.randint(1, 500)}
+            if endpoint == 'PATCH /update_customer':
+                num = rng.choice(self.ids['customer'])
+                return 'PATCH', '/update_customer/{}'.format(num), {
+                    'email': 'customer{}-{}@example.com'.format(
+                        num, rng.randint(0, 999))}
+            if endpoint == 'DELETE /delete_order':
+                order_id = (self.deletable_orders.pop()
+                            if self.deletable_orders else 0)
+                return 'DELETE', '/delete_order/{}'.format(order_id), None
+        raise ValueError('unknown endpoint ' + endpoint)
+
+    def record_response(self, endpoint, data):
+        # orders submitted during the run can be deleted later on
+        if endpoint == 'POST /submit_order' and 'order_id' in data:
+            with self._lock:
+                self.deletable_orders.append(data['order_id'])
+
+
+def percentile(values, fraction):
+    # nearest-rank percentile of sorted 'values'
+    if not values:
+        return None
+    rank = max(math.ceil(fraction * len(values)), 1)
+    return values[rank - 1]
+
+
+def run_client(port, token, workload, endpoints, weights, deadline,
+               random_seed, results):
+    # send requests until 'deadline', appending (endpoint, status,
+    # latency) to 'results'
+    rng = random.Random(random_seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {'Authorization': token, 'Content-Type': 'application/json'}
+    while time.perf_counter() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        method, path, body = workload.request(endpoint)
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, headers=headers, body=(
+                None if body is None else json.dumps(body)))
+            response = connection.getresponse()
+            data = response.read()
+            status = response.status
+        except (http.client.HTTPException, OSError):
+            # the connection was closed by the server, open a new one
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            continue
+        results.append((endpoint, status, time.perf_counter() - start))
+        if status == 200 and endpoint == 'POST /submit_order':
+            workload.record_response(endpoint, json.loads(data))
+    connection.close()
+
+
+def summarize(results, elapsed):
+    # latency percentiles (ms), request rate and status codes per endpoint
+    summary = {}
+    for endpoint in sorted({result[0] for result in results}):
+        latencies = sorted(latency for name, status, latency in results
+                           if name == endpoint)
+        statuses = {}
+        for name, status, latency in results:
+            if name == endpoint:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary[endpoint] = {
+            'requests': len(latencies),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'statuses': statuses
+        }
+    return summary
+
+
+def git_commit():
+    # commit the benchmark ran on, if run from a git checkout
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.bench_load',
+        description='Load test of the warehouse API.')
+    parser.add_argument('--database-url', help=(
+        'benchmark database, emptied and seeded (default: '
+        '$BENCH_DATABASE_URL or {})'.format(harness.DEFAULT_DATABASE_URL)))
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of load after the warm-up')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='seconds of load that are not measured')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=100,
+                        help="'limit' of the list requests")
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the dataset and request mix')
+    parser.add_argument('--output', default='bench_load.json',
+                        help='JSON file the results are written to')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    harness.prepare_environment(args.database_url)
+    # imported only now, they read the environment set up above
+    from werkzeug.serving import make_server
+    from app import create_app
+    from models import db, item_catalog
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        ids = harness.seed(db, args.customers, args.items, args.orders,
+                           args.seed)
+    item_catalog.clear()
+
+    # the server would otherwise log every request
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    token = harness.sign_token()
+    workload = Workload(ids, args.page_size, args.seed)
+    endpoints = list(MIXES[args.mix])
+    weights = [MIXES[args.mix][endpoint] for endpoint in endpoints]
+
+    def run_phase(seconds):
+        results = []
+        deadline = time.perf_counter() + seconds
+        clients = [threading.Thread(target=run_client, args=(
+            server.server_port, token, workload, endpoints, weights,
+            deadline, args.seed + num, results))
+            for num in range(args.concurrency)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return results, time.perf_counter() - start
+
+    try:
+        # warm up the caches and connection pool before measuring
+        run_phase(args.warmup)
+        results, elapsed = run_phase(args.duration)
+    finally:
+        server.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.utcnow().isoformat() + 'Z',
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items()
+                   if key != 'database_url'},
+        'elapsed_seconds': elapsed,
+        'total': {'requests': len(results),
+                  'requests_per_second': len(results) / elapsed},
+        'endpoints': summarize(results, elapsed)
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    print('{:<26}{:>9}{:>9}{:>9}{:>9}{:>9}'.format(
+        'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for endpoint, stats in report['endpoints'].items():
+        errors = sum(count for status, count in stats['statuses'].items()
+                     if not status.startswith('2'))
+        print('{:<26}{:>9.1f}{:>9.2f}{:>9.2f}{:>9.2f}{:>9}'.format(
+            endpoint, stats['requests_per_second'], stats['p50_ms'],
+            stats['p95_ms'], stats['p99_ms'], errors))
+    print('total {:.1f} req/s, results written to {}'.format(
+        report['total']['requests_per_second'], args.output))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+'''
+Cold-start benchmark: how long a fresh process takes to import the app,
+to create it and to serve its first request, and how long gunicorn takes
+until all of its workers are booted, with and without preload_app.
+
+Every measurement runs in new processes and is repeated, the medians are
+reported and written to a JSON file. The first request needs a Postgres
+database with the schema, which is created and seeded with a small dataset
+(the database is emptied, see benchmarks/harness.py):
+
+    python -m benchmarks.bench_startup --repeat 5 --workers 4
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks import harness
+
+# prints the seconds taken by every step of a cold start
+COLD_START_SCRIPT = '''
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get(
+    '/items', headers={{'Authorization': {token!r}}})
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(imported - start, created - imported, served - created)
+'''
+
+# gunicorn settings of the worker boot measurement
+GUNICORN_CONFIG = '''
+import time
+preload_app = {preload}
+workers = {workers}
+bind = '127.0.0.1:0'
+
+
+def post_worker_init(worker):
+    # the worker has loaded the app and is about to accept requests
+    with open({ready_file!r}, 'a') as ready_file:
+        ready_file.write('{{}}\\n'.format(time.time()))
+'''
+
+# starts gunicorn with this interpreter (gunicorn has no __main__ module)
+GUNICORN_RUN = 'from gunicorn.app.wsgiapp import run; run()'
+
+
+def run_python(code):
+    # run 'code' in a new interpreter, returning its output and wall time
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return output.decode(), time.perf_counter() - start
+
+
+def measure_cold_start(token):
+    # seconds from interpreter start to import, create_app and first request
+    output, total = run_python(COLD_START_SCRIPT.format(token=token))
+    imported, created, served = (float(value) for value in output.split())
+    return {'process_seconds': total, 'import_seconds': imported,
+            'create_app_seconds': created, 'first_request_seconds': served}
+
+
+def measure_worker_boot(workers, preload, timeout=60):
+    # seconds from starting gunicorn until every worker has booted
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'gunicorn_bench.conf.py')
+        ready_path = os.path.join(tmp_dir, 'ready')
+        with open(config_path, 'w') as config_file:
+            config_file.write(GUNICORN_CONFIG.format(
+                preload=preload, workers=workers, ready_file=ready_path))
+        start = time.time()
+        server = subprocess.Popen(
+            [sys.executable, '-c', GUNICORN_RUN, '-c', config_path,
+             'wsgi:app'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while time.time() - start < timeout:
+                if os.path.exists(ready_path):
+                    with open(ready_path) as ready_file:
+                        ready = [float(line) for line in ready_file]
+                    if len(ready) >= workers:
+                        return max(ready) - start
+                if server.poll() is not None:
+                    raise RuntimeError('gunicorn exited with status {}'
+                                       .format(server.returncode))
+                time.sleep(0.01)
+            raise RuntimeError('workers did not boot within {} seconds'
+                               .format(timeout))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def medians(samples):
+    return {key: statistics.median(sample[key] for sample in samples)
+            for key in samples[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.bench_startup',
+        description='Cold-start benchmark of the warehouse API.')
+    parser.add_argument('--database-url', help=(
+        'benchmark database, emptied and seeded (default: '
+        '$BENCH_DATABASE_URL or {})'.format(harness.DEFAULT_DATABASE_URL)))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='gunicorn workers')
+    parser.add_argument('--output', default='bench_startup.json')
+    args = parser.parse_args(argv)
+
+    harness.prepare_environment(args.database_url)
+    # create the schema and a small dataset for the first request
+    from app import create_app
+    from models import db
+    with create_app().app_context():
+        db.create_all()
+        harness.seed(db, customers=10, items=10, orders=10)
+    token = harness.sign_token()
+
+    # the interpreter alone, to tell it apart from the app's own start-up
+    interpreter = statistics.median(
+        run_python('pass')[1] for _ in range(args.repeat))
+    cold_start = medians([measure_cold_start(token)
+                          for _ in range(args.repeat)])
+    worker_boot = {
+        'preload': statistics.median(
+            measure_worker_boot(args.workers, True)
+            for _ in range(args.repeat)),
+        'no_preload': statistics.median(
+            measure_worker_boot(args.workers, False)
+            for _ in range(args.repeat))
+    }
+    report = {
+        'python': sys.version.split()[0],
+        'config': {'repeat': args.repeat, 'workers': args.workers},
+        'interpreter_seconds': interpreter,
+        'cold_start': cold_start,
+        'worker_boot_seconds': worker_boot
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    print('interpreter start     {:>8.1f} ms'.format(interpreter * 1000))
+    for name, seconds in cold_start.items():
+        print('{:<22}{:>8.1f} ms'.format(name.replace('_seconds', ''),
+                                         seconds * 1000))
+    for name, seconds in worker_boot.items():
+        print('{:<22}{:>8.1f} ms ({} workers)'.format(
+            'boot ' + name, seconds * 1000, args.workers))
+    print('results written to {}'.format(args.output))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Shared set-up of the benchmarks that run the whole app: a local signing
+key served as the JWKS from a file (so no Auth0 tenant is needed), tokens
+signed with it, and a reproducible seeded dataset.
+
+prepare_environment() has to run before create_app() is called, which
+reads the configuration from the environment.
+'''
+import os
+import json
+import time
+import base64
+import random
+import tempfile
+from datetime import datetime, timedelta
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+# database the benchmarks run against, its tables are emptied by seed()
+DEFAULT_DATABASE_URL = 'postgres://localhost:5432/warehouse_bench'
+# key id of the benchmark signing key
+KEY_ID = 'benchmark-key'
+# every permission of the API (the warehouse manager role)
+ALL_PERMISSIONS = [
+    'delete:customer', 'delete:item', 'delete:order', 'get:customers',
+    'get:items', 'get:orders', 'patch:customer', 'patch:item',
+    'post:customer', 'post:item', 'post:order'
+]
+
+# signing key of the current benchmark run
+private_key = None
+
+
+def b64_int(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def prepare_environment(database_url=None):
+    '''
+    Generate the signing key, write its JWKS to a temporary file and point
+    the app configuration at it and at the benchmark database.
+    '''
+    global private_key
+    private_key = RSA.generate(2048)
+    jwks = {'keys': [{'kty': 'RSA', 'kid': KEY_ID, 'use': 'sig',
+                      'n': b64_int(private_key.n),
+                      'e': b64_int(private_key.e)}]}
+    jwks_file = tempfile.NamedTemporaryFile(
+        'w', suffix='.json', prefix='jwks-', delete=False)
+    with jwks_file:
+        json.dump(jwks, jwks_file)
+    os.environ['JWKS_URL'] = 'file://' + jwks_file.name
+    os.environ['DATABASE_URL'] = (database_url or os.environ.get(
+        'BENCH_DATABASE_URL', DEFAULT_DATABASE_URL))
+    os.environ.setdefault('AUTH0_DOMAIN', 'benchmark.auth0.com')
+    os.environ.setdefault('ALGORITHMS', "['RS256']")
+    os.environ.setdefault('API_AUDIENCE', 'warehouse-api')
+    return jwks_file.name
+
+
+def sign_token(permissions=ALL_PERMISSIONS, lifetime=3600):
+    # 'Authorization' header value of a token accepted by the app
+    token = jwt.encode({
+        'iss': 'https://' + os.environ['AUTH0_DOMAIN'] + '/',
+        'aud': os.environ['API_AUDIENCE'],
+        'exp': int(time.time()) + lifetime,
+        'permissions': list(permissions)
+    }, private_key.export_key().decode(), algorithm='RS256',
+        headers={'kid': KEY_ID})
+    return 'Bearer ' + token
+
+
+def seed(db, customers=1000, items=500, orders=10000, random_seed=0):
+    '''
+    Empty the tables and insert 'customers', 'items' and 'orders' rows.
+    The same arguments always produce the same dataset. Returns the ids of
+    the inserted rows per table.
+    '''
+    from models import (Customer, Item, Orders, TableVersion,
+                        rebuild_daily_sales)
+    rng = random.Random(random_seed)
+    db.session.execute('TRUNCATE orders, customer, item, daily_sales, '
+                       'table_version RESTART IDENTITY CASCADE')
+    db.session.execute(Customer.__table__.insert(), [
+        {'name': 'customer {}'.format(num),
+         'email': 'customer{}@example.com'.format(num),
+         'join_date': datetime(2020, 1, 1) + timedelta(hours=num)}
+        for num in range(customers)])
+    prices = [rng.randint(1, 500) for _ in range(items)]
+    db.session.execute(Item.__table__.insert(), [
+        {'name': 'item {}'.format(num),
+         'brand': 'brand {}'.format(num % 50),
+         'price': prices[num], 'available': True}
+        for num in range(items)])
+    order_rows = []
+    for num in range(orders):
+        item_id = rng.randint(1, items)
+        quantity = rng.randint(1, 10)
+        order_rows.append({
+            'order_date': datetime(2020, 1, 1) + timedelta(
+                minutes=rng.randint(0, 365 * 24 * 60)),
+            'customer_id': rng.randint(1, customers),
+            'item_id': item_id,
+            'quantity': quantity,
+            'amount_due': prices[item_id - 1] * quantity})
+    if order_rows:
+        db.session.execute(Orders.__table__.insert(), order_rows)
+    # the orders were inserted around the model helpers
+    rebuild_daily_sales()
+    db.session.execute(TableVersion.__table__.insert(), [
+        {'name': name, 'version': 0}
+        for name in ('customer', 'item', 'orders')])
+    db.session.commit()
+    return {'customer': list(range(1, customers + 1)),
+            'item': list(range(1, items + 1)),
+            'orders': list(range(1, orders + 1))}
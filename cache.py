@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''
+    Bounded in-process LRU cache. Entries expire 'ttl' seconds after they
+    were stored, or at the time given to set(), and the least recently used
+    entry is evicted once the cache holds 'max_size' entries. 'clock' tells
+    the time expiries are measured in. Keeps hit and miss counters.
+    '''
+
+    def __init__(self, max_size, ttl=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (expiry time, value), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            # drop expired entries as they are found
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, expires_at=None):
+        # 'expires_at' overrides the ttl of the cache for this entry
+        if self.max_size <= 0:
+            return
+        if expires_at is None:
+            expires_at = self.clock() + self.ttl
+        with self._lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            # evict least recently used entries beyond the size cap
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+        if self.ttl is not None:
+            stats['ttl'] = self.ttl
+        return stats
+
+
+# shared cache backends
+
+# pub/sub channel carrying invalidation messages
+CACHE_CHANNEL = os.environ.get('CACHE_CHANNEL', 'warehouse:invalidate')
+# separates the cache namespace from the key in shared keys and messages
+KEY_SEPARATOR = ':'
+
+
+class LocalBackend:
+    '''
+    Backend used when no shared cache is configured. Nothing is shared
+    between processes and invalidation messages only reach this process.
+    '''
+    shared = False
+
+    def __init__(self):
+        self.subscribers = []
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def publish(self, message):
+        for callback in self.subscribers:
+            callback(message)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def listen(self):
+        pass
+
+
+class RedisBackend:
+    '''
+    Backend that shares cached values between processes (for example
+    gunicorn workers, on one or many hosts) through a Redis server and
+    delivers invalidation messages to every process over Redis pub/sub.
+    'client' is a redis-py client, or any stand-in providing the same
+    mget/set/delete/publish/pubsub methods.
+    '''
+    shared = True
+
+    def __init__(self, client, channel=CACHE_CHANNEL):
+        self.client = client
+        self.channel = channel
+        self.subscribers = []
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    # a failing cache server must not fail requests, values are then
+    # simply loaded from their source again
+
+    def get_many(self, keys):
+        try:
+            return self.client.mget(keys)
+        except Exception as exc:
+            print('Exception:', exc)
+            return [None] * len(keys)
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(key, value, ex=ttl)
+        except Exception as exc:
+            print('Exception:', exc)
+
+    def delete(self, key):
+        try:
+            self.client.delete(key)
+        except Exception as exc:
+            print('Exception:', exc)
+
+    def publish(self, message):
+        try:
+            self.client.publish(self.channel, message)
+        except Exception as exc:
+            print('Exception:', exc)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def listen(self):
+        # start the listener thread of this process on first use, not at
+        # import. Threads do not survive a fork, so every gunicorn worker
+        # starts its own
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        thread = threading.Thread(target=self._listen, daemon=True)
+        thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    data = message['data']
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    for callback in self.subscribers:
+                        callback(data)
+            except Exception as exc:
+                # reconnect after a short pause, until then local entries
+                # still expire with their TTL
+                print('Exception:', exc)
+                time.sleep(1)
+
+
+def create_backend(url=None):
+    '''
+    Shared cache backend for CACHE_URL (redis://host:port/db), or a
+    LocalBackend when no URL is configured.
+    '''
+    url = url or os.environ.get('CACHE_URL')
+    if not url:
+        return LocalBackend()
+    # redis is only needed when a shared cache is configured
+    import redis
+    return RedisBackend(redis.Redis.from_url(url))
+
+
+shared_backend = create_backend()
+
+
+class SharedCache:
+    '''
+    Two level cache: a per-process TTLCache in front of a shared backend.
+    Values missing locally are looked up in the backend, so a value loaded
+    by one worker warms all the others, and invalidate() removes a key from
+    the backend and, through an invalidation message, from every process.
+    Values are stored in the backend as strings made by 'dumps'.
+    '''
+
+    def __init__(self, namespace, max_size, ttl, backend=None,
+                 dumps=json.dumps, loads=json.loads):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = TTLCache(max_size, ttl)
+        self.backend = backend or shared_backend
+        self.dumps = dumps
+        self.loads = loads
+        self.shared_hits = 0
+        self.backend.subscribe(self._on_message)
+
+    def _shared_key(self, key):
+        return '{}{}{}'.format(self.namespace, KEY_SEPARATOR, key)
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        # returns a dict of key -> value for the keys found in either level
+        self.backend.listen()
+        values = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(str(key))
+            if value is None:
+                missing.append(key)
+            else:
+                values[key] = value
+        if missing and self.backend.shared:
+            shared_values = self.backend.get_many(
+                [self._shared_key(key) for key in missing])
+            for key, raw in zip(missing, shared_values):
+                if raw is not None:
+                    value = self.loads(raw)
+                    self.local.set(str(key), value)
+                    values[key] = value
+                    self.shared_hits += 1
+        return values
+
+    def set(self, key, value):
+        self.local.set(str(key), value)
+        if self.backend.shared:
+            self.backend.set(self._shared_key(key), self.dumps(value),
+                             self.ttl)
+
+    def invalidate(self, key):
+        self.local.delete(str(key))
+        self.backend.delete(self._shared_key(key))
+        self.backend.publish(self._shared_key(key))
+
+    def _on_message(self, message):
+        namespace, _, key = message.partition(KEY_SEPARATOR)
+        if namespace == self.namespace:
+            self.local.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.shared_hits = 0
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['shared_hits'] = self.shared_hits
+        stats['backend'] = type(self.backend).__name__
+        return stats
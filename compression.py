@@ -0,0 +1,120 @@
+'''
+Compression of the responses, negotiated from the Accept-Encoding header:
+brotli when the client accepts it and the optional brotli package is
+installed, gzip otherwise. Responses smaller than COMPRESS_MIN_SIZE are
+sent as they are, compressing them would cost more time than the bytes
+saved. Streamed responses (the list exports) have no size until they are
+sent, so they are always compressed, chunk by chunk as they are written.
+'''
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# smallest response body in bytes that is compressed
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# gzip level, from 1 (fastest) to 9 (smallest)
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+# brotli quality, from 0 (fastest) to 11 (smallest)
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+# media types of the responses that are compressed
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/msgpack',
+                          'text/plain', 'text/html')
+
+
+class GzipCompressor:
+    # gzip stream compressor with the interface of brotli.Compressor
+
+    def __init__(self, level=None):
+        # wbits 16 + 15 writes a gzip header and trailer
+        self.compressor = zlib.compressobj(
+            GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        # everything passed so far, so a chunk can be sent right away
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+def create_compressor(encoding, level=None):
+    '''
+    Stream compressor of the content coding 'encoding' ('gzip' or 'br'),
+    at 'level' or the configured level of the coding.
+    '''
+    if encoding == 'br':
+        return brotli.Compressor(
+            quality=BROTLI_QUALITY if level is None else level)
+    return GzipCompressor(level)
+
+
+def get_encoding():
+    # content coding of the current response, or None to send it as is
+    encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+    return request.accept_encodings.best_match(encodings)
+
+
+def compress(data, encoding, level=None):
+    # 'data' compressed with 'encoding'
+    compressor = create_compressor(encoding, level)
+    return compressor.process(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    # compress every chunk of a streamed body and send it right away
+    compressor = create_compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # the server closes this generator, pass it on to the body (e.g.
+        # to end its request context)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    # after_request hook compressing the response if the client accepts it
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    # the body depends on Accept-Encoding even when it is not compressed
+    response.vary.add('Accept-Encoding')
+    encoding = get_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # the compressed body is another representation of the same data, so
+    # its ETag only matches weakly (as If-None-Match compares them)
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    # compress the responses of 'app'
+    app.after_request(compress_response)
@@ -0,0 +1,27 @@
+import os
+import glob
+import tempfile
+
+# import the app once in the master and fork the workers from it, which
+# shortens worker boot and shares the loaded modules between workers
+preload_app = True
+
+# gunicorn loads this file from the working directory before the app is
+# imported, so the workers inherit the metrics directory set here and
+# /metrics reports the totals of all of them
+metrics_dir = os.environ.setdefault(
+    'prometheus_multiproc_dir',
+    os.path.join(tempfile.gettempdir(), 'warehouse-metrics'))
+# start with empty counters, files left by a previous run would be added to
+# the new totals. Done here rather than in on_starting, which runs after
+# the preloaded app has already created its metrics. Only prometheus's own
+# files are removed, the directory may be one the operator chose
+os.makedirs(metrics_dir, exist_ok=True)
+for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+    os.remove(path)
+
+
+def child_exit(server, worker):
+    # drop the live gauges of a stopped worker, its counters are kept
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,14 +1,32 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from app import app
+from datetime import date
+
+import models
+from app import create_app
 from models import db
 
+app = create_app()
 migrate = Migrate(app, db)
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('--start', help='first day to rebuild (YYYY-MM-DD)')
+@manager.option('--end', help='last day to rebuild (YYYY-MM-DD)')
+def rebuild_daily_sales(start=None, end=None):
+    '''Recompute the daily sales rollup from the orders table'''
+    # all days unless a range is given, in one transaction
+    start = date.fromisoformat(start) if start else None
+    end = date.fromisoformat(end) if end else None
+    models.rebuild_daily_sales(start, end)
+    db.session.commit()
+    num_rows = db.session.query(db.func.count()).select_from(
+        models.DailySales).scalar()
+    print('daily_sales rebuilt, {} rows'.format(num_rows))
+
+
 if __name__ == '__main__':
     manager.run()
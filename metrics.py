@@ -0,0 +1,129 @@
+import os
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.http import HTTP_STATUS_CODES
+from prometheus_client import (Counter, Histogram, CollectorRegistry,
+                               REGISTRY, generate_latest, multiprocess)
+
+# prometheus_client keeps the samples of every worker process in files in
+# this directory when it is set (before prometheus_client is imported), so
+# that /metrics reports the totals of all gunicorn workers
+MULTIPROC_DIR_VARIABLE = 'prometheus_multiproc_dir'
+
+# buckets (in seconds) of the latency histograms
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+                   5, 10)
+# buckets of the queries per request histogram
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route.',
+    ['method', 'route'], buckets=LATENCY_BUCKETS)
+REQUEST_COUNT = Counter(
+    'http_requests_total', 'Requests by route and status code.',
+    ['method', 'route', 'status'])
+ERROR_COUNT = Counter(
+    'http_request_errors_total',
+    'Error responses by route, status code and error.',
+    ['method', 'route', 'status', 'error'])
+JWT_VERIFY_LATENCY = Histogram(
+    'jwt_verify_duration_seconds', 'Time spent in verify_decode_jwt.',
+    buckets=LATENCY_BUCKETS)
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds', 'Duration of single database queries.',
+    buckets=LATENCY_BUCKETS)
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', 'Number of database queries per request.',
+    ['method', 'route'], buckets=QUERY_COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram(
+    'db_request_duration_seconds', 'Database time per request.',
+    ['method', 'route'], buckets=LATENCY_BUCKETS)
+
+
+def get_route():
+    # the url rule ('/update_item/<int:id>') rather than the path keeps the
+    # number of label values bounded, unmatched paths share one value
+    if request.url_rule is None:
+        return 'unmatched'
+    return request.url_rule.rule
+
+
+def set_error(error):
+    # name the error of the current response, e.g. the AuthError code
+    g.metrics_error = error
+
+
+def before_request():
+    g.metrics_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_time = 0.0
+
+
+def after_request(response):
+    # runs for the responses of the error handlers as well
+    start = g.get('metrics_start')
+    if start is None:
+        return response
+    method = request.method
+    route = get_route()
+    status = str(response.status_code)
+    REQUEST_LATENCY.labels(method, route).observe(
+        time.perf_counter() - start)
+    REQUEST_COUNT.labels(method, route, status).inc()
+    if response.status_code >= 400:
+        error = g.get('metrics_error') or HTTP_STATUS_CODES.get(
+            response.status_code, 'unknown')
+        # e.g. 'Not Found' -> 'not_found'
+        error = error.lower().replace(' ', '_')
+        ERROR_COUNT.labels(method, route, status, error).inc()
+    DB_QUERIES_PER_REQUEST.labels(method, route).observe(g.db_queries)
+    DB_TIME_PER_REQUEST.labels(method, route).observe(g.db_time)
+    return response
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    DB_QUERY_LATENCY.observe(duration)
+    # queries outside of a request (e.g. manage.py) have no request totals
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_time += duration
+
+
+def handle_error(context):
+    # a failed query never reaches after_cursor_execute
+    query_start = context.connection.info.get('query_start')
+    if query_start:
+        query_start.pop()
+
+
+def init_metrics(app):
+    '''
+    Record request and database metrics of 'app'. Queries are timed on
+    every SQLAlchemy engine, so an engine created again for a new database
+    URI (setup_db called with another path) is timed as well.
+    '''
+    app.before_request(before_request)
+    app.after_request(after_request)
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+
+
+def generate_metrics():
+    # exposition of the metrics, summed over all workers in multiprocess mode
+    if os.environ.get(MULTIPROC_DIR_VARIABLE):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,47 @@
+"""add daily_sales rollup for revenue reports
+
+Revision ID: 3b8e51c0d7a4
+Revises: f70a98bb367d
+Create Date: 2026-10-18 14:36:12.480193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e51c0d7a4'
+down_revision = 'f70a98bb367d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the benchmarks create their schema with db.create_all(), which may
+    # already have created it in a benchmark database
+    if 'daily_sales' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'daily_sales',
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('item_id', sa.Integer(), nullable=False),
+            sa.Column('revenue', sa.BigInteger(), nullable=False),
+            sa.Column('quantity', sa.BigInteger(), nullable=False),
+            sa.Column('num_orders', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['item_id'], ['item.id'],
+                                    ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('day', 'item_id')
+        )
+    # fill the rollup from the existing orders (manage.py
+    # rebuild_daily_sales does the same later on)
+    op.execute('DELETE FROM daily_sales')
+    op.execute(
+        'INSERT INTO daily_sales (day, item_id, revenue, quantity, '
+        'num_orders) '
+        'SELECT date(order_date), item_id, coalesce(sum(amount_due), 0), '
+        'coalesce(sum(quantity), 0), count(id) FROM orders '
+        'WHERE order_date IS NOT NULL AND item_id IS NOT NULL '
+        'GROUP BY date(order_date), item_id')
+
+
+def downgrade():
+    op.drop_table('daily_sales')
@@ -0,0 +1,37 @@
+"""index orders foreign keys and order_date
+
+Revision ID: 6cbc2b9efbd6
+Revises: d6d2a68d3e15
+Create Date: 2026-10-18 10:12:31.482107
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6cbc2b9efbd6'
+down_revision = 'd6d2a68d3e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY does not lock out writes to the orders
+    # table, but it cannot run inside a transaction. IF NOT EXISTS keeps
+    # the migration re-runnable, since the indexes are committed before
+    # alembic records the new revision
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                   'ix_orders_customer_id ON orders (customer_id)')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                   'ix_orders_item_id ON orders (item_id)')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                   'ix_orders_order_date ON orders (order_date)')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_orders_order_date')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_orders_item_id')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_orders_customer_id')
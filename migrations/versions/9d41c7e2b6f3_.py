@@ -0,0 +1,62 @@
+"""index the customer and item search and filter columns
+
+Revision ID: 9d41c7e2b6f3
+Revises: 3b8e51c0d7a4
+Create Date: 2026-10-18 15:20:44.913572
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d41c7e2b6f3'
+down_revision = '3b8e51c0d7a4'
+branch_labels = None
+depends_on = None
+
+# columns searched by ?q= (ILIKE '%q%'), indexed with trigrams
+TRIGRAM_INDEXES = [
+    ('ix_customer_name_trgm', 'customer', 'name'),
+    ('ix_customer_email_trgm', 'customer', 'email'),
+    ('ix_item_name_trgm', 'item', 'name'),
+    ('ix_item_brand_trgm', 'item', 'brand')
+]
+
+
+def trigram_available():
+    # pg_trgm ships with the Postgres contrib modules, which most hosted
+    # databases (e.g. Heroku) include but minimal builds may not
+    return op.get_bind().execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    ).scalar() is not None
+
+
+def upgrade():
+    trigram = trigram_available()
+    if trigram:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # built concurrently outside of a transaction, like the orders indexes
+    # of 6cbc2b9efbd6, so that writes are not locked out
+    with op.get_context().autocommit_block():
+        # ?brand= (ignoring case) and ?min_price=/?max_price= filters
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                   'ix_item_brand_lower ON item (lower(brand))')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                   'ix_item_price ON item (price)')
+        if not trigram:
+            print('pg_trgm is not available, ?q= searches will scan the '
+                  'customer and item tables')
+            return
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} '
+                       'USING gin ({} gin_trgm_ops)'.format(
+                           name, table, column))
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, column in reversed(TRIGRAM_INDEXES):
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name))
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_item_price')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_item_brand_lower')
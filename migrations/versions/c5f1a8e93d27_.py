@@ -0,0 +1,34 @@
+"""add item stock for atomic order reservations
+
+Revision ID: c5f1a8e93d27
+Revises: 9d41c7e2b6f3
+Create Date: 2026-10-18 17:42:09.318604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f1a8e93d27'
+down_revision = '9d41c7e2b6f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the benchmarks create their schema with db.create_all(), which may
+    # already have added the stock column in a benchmark database.
+    # Existing items keep a NULL stock, which is not tracked, until a
+    # stock is set through PATCH /update_item
+    columns = sa.inspect(op.get_bind()).get_columns('item')
+    if 'stock' not in [column['name'] for column in columns]:
+        op.add_column('item', sa.Column('stock', sa.Integer(),
+                                        nullable=True))
+        op.create_check_constraint('ck_item_stock_non_negative', 'item',
+                                   'stock >= 0')
+
+
+def downgrade():
+    op.drop_constraint('ck_item_stock_non_negative', 'item', type_='check')
+    op.drop_column('item', 'stock')
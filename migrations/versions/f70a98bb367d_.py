@@ -0,0 +1,45 @@
+"""add table_version for list endpoint ETags
+
+Revision ID: f70a98bb367d
+Revises: 6cbc2b9efbd6
+Create Date: 2026-10-18 11:02:47.915320
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f70a98bb367d'
+down_revision = '6cbc2b9efbd6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_version = sa.table(
+        'table_version',
+        sa.column('name', sa.String(length=30)),
+        sa.column('version', sa.BigInteger())
+    )
+    # the benchmarks create their schema with db.create_all(), which may
+    # already have created the table in a benchmark database
+    if 'table_version' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'table_version',
+            sa.Column('name', sa.String(length=30), nullable=False),
+            sa.Column('version', sa.BigInteger(), nullable=False),
+            sa.PrimaryKeyConstraint('name')
+        )
+    # keep the stamps of tables that were already written to, moving them
+    # back would make old ETags match again
+    op.execute(postgresql.insert(table_version).values([
+        {'name': 'customer', 'version': 0},
+        {'name': 'item', 'version': 0},
+        {'name': 'orders', 'version': 0}
+    ]).on_conflict_do_nothing(index_elements=['name']))
+
+
+def downgrade():
+    op.drop_table('table_version')
@@ -1,19 +1,72 @@
 import os
+import json
+from collections import namedtuple
+from datetime import timedelta
 from flask_sqlalchemy import SQLAlchemy
 from flask import Flask
+from sqlalchemy.dialects import postgresql
+from cache import SharedCache
+from querylog import init_query_log
 
-# get database path from environment variable
-database_path = os.environ['DATABASE_URL']
+# size and time to live (in seconds) of the item catalog cache
+ITEM_CACHE_SIZE = int(os.environ.get('ITEM_CACHE_SIZE', 10000))
+ITEM_CACHE_TTL = int(os.environ.get('ITEM_CACHE_TTL', 60))
 
 db = SQLAlchemy()
 
 
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    # database path defaults to the DATABASE_URL environment variable. The<br>
+    # schema is created by the migrations (manage.py db upgrade), so no<br>
+    # connection is made until the first query
+    app.config["SQLALCHEMY_DATABASE_URI"] = (
+        database_path or os.environ['DATABASE_URL'])
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
-    db.create_all()
+    # log slow queries and report repeated ones (N+1) in testing and debug
+    init_query_log()
+
+
+# table versions
+
+class TableVersion(db.Model):
+    '''
+    Version stamp per table that moves on every write made through the
+    model insert(), update() and delete() helpers. List endpoints build
+    their ETags from it.
+    '''
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<TableVersion {}: {}>'.format(self.name, self.version)
+
+
+def bump_version(*tables):
+    '''
+    Move the version stamps of 'tables' in the current transaction, so
+    they move if and only if the write commits. Called as the last
+    statement before the commit, so the stamp rows stay locked only for
+    the commit itself.
+    '''
+    table = TableVersion.__table__
+    # rows are locked in name order, so concurrent bumps cannot deadlock
+    statement = postgresql.insert(table).values(
+        [{'name': name, 'version': 1} for name in sorted(set(tables))])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={'version': table.c.version + 1}))
+
+
+def get_versions(*tables):
+    # current version stamps of 'tables', 0 for tables never written to
+    versions = dict.fromkeys(tables, 0)
+    versions.update(db.session.query(
+        TableVersion.name, TableVersion.version).filter(
+        TableVersion.name.in_(tables)))
+    return versions
 
 
 class Customer(db.Model):
@@ -32,13 +85,22 @@ class Customer(db.Model):
     # insert, update and delete functions for Customer class
     def insert(self):
         db.session.add(self)
+        bump_version('customer')
         db.session.commit()
 
     def update(self):
+        bump_version('customer')
         db.session.commit()
 
     def delete(self):
+        # (re)attach the customer to the session, then delete its orders<br>
+        # first, taking them out of the daily sales rollup, so the cascade<br>
+        # below finds none left to delete
+        db.session.add(self)
+        delete_orders(Orders.customer_id == self.id)
+        db.session.expire(self, ['orders'])
         db.session.delete(self)
+        bump_version('customer', 'orders')
         db.session.commit()
 
     # __repr__ returns customer name
@@ -50,53 +112,220 @@ class Item(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), unique=True)
     brand = db.Column(db.String(30))
-    price = db.Column(db.Integer)
+    # price and lower(brand) are indexed for the /items filters. The<br>
+    # trigram indexes of the ?q= search on name and brand (and on the<br>
+    # customer name and email) need the pg_trgm extension and are only<br>
+    # created by the 9d41c7e2b6f3 migration
+    price = db.Column(db.Integer, index=True)
     # product availability has a default of true
     available = db.Column(db.Boolean, default=True)
+    # units in stock, taken by reserve_stock() as orders are submitted.<br>
+    # NULL means that the stock of the item is not tracked
+    stock = db.Column(db.Integer)
+    __table_args__ = (
+        db.Index('ix_item_brand_lower', db.func.lower(brand)),
+        db.CheckConstraint('stock >= 0', name='ck_item_stock_non_negative'))
     # orders assists the relationship between orders and table with a<br>
     # backref of 'item' allowing Orders objects to include data from<br>
     # the 'Item' table. Cascade 'all,delete' enables<br>
     # deletion without violating foreign key constraints
     orders = db.relationship('Orders', cascade='all, delete', backref='item')
 
-    # insert, update and delete functions for Item class
+    # insert, update and delete functions for Item class. Each of them<br>
+    # drops the item from the item catalog cache once committed
     def insert(self):
         db.session.add(self)
+        bump_version('item')
         db.session.commit()
+        item_catalog.invalidate(self.id)
 
     def update(self):
+        bump_version('item')
         db.session.commit()
+        item_catalog.invalidate(self.id)
 
     def delete(self):
         db.session.delete(self)
+        id = self.id
+        # the item's orders are deleted with it, its daily sales rows by<br>
+        # the ON DELETE CASCADE of their foreign key
+        bump_version('item', 'orders')
         db.session.commit()
+        item_catalog.invalidate(id)
 
     # __repr__ returns Item name and availability
     def __repr__(self):
         return '<Item: {}, Available: {}>'.format(self.name, self.available)
 
 
+def reserve_stock(item_id, quantity):
+    '''
+    Take 'quantity' units of item 'item_id' out of stock with a single
+    conditional UPDATE item SET stock = stock - :quantity WHERE stock >=
+    :quantity RETURNING price. The check and the decrement are one
+    statement, so concurrent orders can never both take the last units,
+    and no row is locked while python code decides. Items whose stock is
+    not tracked (NULL) only need to be available. Returns the price of the
+    item, or None if it does not exist, is not available or has too few
+    units left. The caller commits.
+    '''
+    table = Item.__table__
+    return db.session.execute(
+        table.update().where(table.c.id == item_id).where(
+            table.c.available.isnot(False)).where(
+            db.or_(table.c.stock.is_(None), table.c.stock >= quantity)
+        ).values(stock=table.c.stock - quantity).returning(table.c.price)
+    ).scalar()
+
+
+def reserve_stock_many(quantities):
+    '''
+    reserve_stock() for several items at once, 'quantities' maps item ids
+    to the number of units to take. Items are reserved all or nothing, each
+    with one UPDATE ... FROM unnest(...) statement. Returns a dict of item
+    id -> price of the reserved items, and a dict of item id -> reason
+    ('item not found', 'item not available' or 'insufficient stock') of
+    the others. The caller commits.
+    '''
+    if not quantities:
+        return {}, {}
+    ids = sorted(quantities)
+    # lock the rows in id order first, so that concurrent bulk orders of<br>
+    # the same items wait for each other instead of deadlocking. The<br>
+    # locked rows also tell why an item could not be reserved
+    available = {row.id: row.available for row in db.session.execute(
+        'SELECT id, available FROM item WHERE id = ANY(:ids) '
+        'ORDER BY id FOR UPDATE', {'ids': ids})}
+    rows = db.session.execute(
+        'UPDATE item SET stock = item.stock - reserved.quantity '
+        'FROM (SELECT unnest(CAST(:ids AS integer[])) AS id, '
+        'unnest(CAST(:quantities AS integer[])) AS quantity) AS reserved '
+        'WHERE item.id = reserved.id AND item.available IS NOT FALSE '
+        'AND (item.stock IS NULL OR item.stock >= reserved.quantity) '
+        'RETURNING item.id, item.price',
+        {'ids': ids, 'quantities': [quantities[id] for id in ids]})
+    prices = {row.id: row.price for row in rows}
+    errors = {}
+    for id in ids:
+        if id in prices:
+            continue
+        if id not in available:
+            errors[id] = 'item not found'
+        elif available[id] is False:
+            errors[id] = 'item not available'
+        else:
+            errors[id] = 'insufficient stock'
+    return prices, errors
+
+
+# item catalog cache
+
+# cached item data used by the item listing
+# 'version' is the item table version stamp the entry was loaded at
+CatalogItem = namedtuple('CatalogItem', ['id', 'name', 'brand', 'price',
+                                         'available', 'version'])
+
+
+class ItemCatalog:
+    '''
+    Read-through cache of item data keyed by item id. Items change rarely,
+    so they are served from memory and only loaded from the database on a
+    miss. The cache is shared between workers through the configured cache
+    backend (see cache.py) and the Item write helpers invalidate changed
+    items in every worker. Invalidation messages can be lost or overtaken
+    by a concurrent load, so entries also carry the item table version
+    stamp and lookups treat entries older than the current stamp as misses.
+    '''
+
+    def __init__(self, max_size=ITEM_CACHE_SIZE, ttl=ITEM_CACHE_TTL,
+                 backend=None):
+        self.cache = SharedCache(
+            'item', max_size, ttl, backend=backend,
+            dumps=lambda item: json.dumps(list(item)),
+            loads=lambda raw: CatalogItem(*json.loads(raw)))
+
+    def get(self, id, version=None):
+        # returns the CatalogItem with 'id', or None if there is no such item
+        return self.get_many([id], version).get(id)
+
+    def get_many(self, ids, version=None):
+        '''
+        Returns a dict of id -> CatalogItem for the ids that exist. Entries
+        loaded before the item table 'version' are misses, all misses are
+        loaded with a single IN (...) query. 'version' must be read before
+        the ids were (as list_etag does), it is read here if not given.
+        '''
+        if version is None:
+            version = get_versions('item')['item']
+        items = {id: item for id, item in self.cache.get_many(ids).items()
+                 if item.version >= version}
+        missing = [id for id in ids if id not in items]
+        if missing:
+            rows = db.session.query(
+                Item.id, Item.name, Item.brand, Item.price,
+                Item.available).filter(Item.id.in_(missing))
+            for row in rows:
+                # tagged with the version read before the rows, so a write
+                # committed in between makes the entry older, never newer
+                item = CatalogItem(*row, version)
+                self.cache.set(item.id, item)
+                items[item.id] = item
+        return items
+
+    def invalidate(self, *ids):
+        for id in ids:
+            self.cache.invalidate(id)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+item_catalog = ItemCatalog()
+
+
 class Orders(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_date = db.Column(db.DateTime)
+    # the foreign keys and order_date are indexed for per customer/item<br>
+    # lookups, cascading deletes and date filters
+    order_date = db.Column(db.DateTime, index=True)
     # declare customer_id as a foreign key for customer.id
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'),
+                            index=True)
     # declare item_id as a foreign key for item.id
-    item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), index=True)
     quantity = db.Column(db.Integer)
     amount_due = db.Column(db.Integer)
     amount_paid = db.Column(db.Integer)
 
-    # insert, update and delete functions for Orders class
+    # insert, update and delete functions for Orders class. The daily<br>
+    # sales rollup is updated in the same transaction
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        add_daily_sales(Orders.id == self.id)
+        bump_version('orders')
         db.session.commit()
 
     def update(self):
+        # take the stored order out of the rollup (locking its row against<br>
+        # concurrent updates) and add it back with its new values
+        with db.session.no_autoflush:
+            stored = db.session.query(
+                Orders.order_date, Orders.item_id, Orders.quantity,
+                Orders.amount_due).filter(
+                Orders.id == self.id).with_for_update().one()
+        subtract_daily_sales([stored])
+        db.session.flush()
+        add_daily_sales(Orders.id == self.id)
+        bump_version('orders')
         db.session.commit()
 
     def delete(self):
-        db.session.delete(self)
+        delete_orders(Orders.id == self.id)
+        bump_version('orders')
         db.session.commit()
     # __repr__ returns order info including customer name,<br>
     # item name, and quantity.
@@ -106,3 +335,120 @@ class Orders(db.Model):
     def __repr__(self):
         return '<Customer: {}, Item: {}, Quantity: {}>'.format(
             self.customer.name, self.item.name, self.quantity)
+
+
+# daily sales rollup
+
+class DailySales(db.Model):
+    '''
+    Revenue, quantity and number of orders per day and item, kept up to
+    date with the orders table by add_daily_sales(), subtract_daily_sales()
+    and delete_orders() in the transactions that write orders. Reports
+    grouped by item, brand or day read it instead of the orders.
+    '''
+    __tablename__ = 'daily_sales'
+    day = db.Column(db.Date, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey(
+        'item.id', ondelete='CASCADE'), primary_key=True)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)
+    quantity = db.Column(db.BigInteger, nullable=False, default=0)
+    num_orders = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<DailySales {} item {}: {}>'.format(
+            self.day, self.item_id, self.revenue)
+
+
+def upsert_daily_sales(statement):
+    # add the rows of an INSERT into daily_sales to the existing totals.<br>
+    # Concurrent writers of the same day and item wait for each other's<br>
+    # row lock, so no increment is lost
+    table = DailySales.__table__
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.day, table.c.item_id],
+        set_={'revenue': table.c.revenue + statement.excluded.revenue,
+              'quantity': table.c.quantity + statement.excluded.quantity,
+              'num_orders': (table.c.num_orders +
+                             statement.excluded.num_orders)})
+
+
+def daily_sales_select(condition=None):
+    # totals per day and item of the orders matching 'condition'
+    day = db.func.date(Orders.order_date)
+    query = db.session.query(
+        day, Orders.item_id,
+        db.func.coalesce(db.func.sum(Orders.amount_due), 0),
+        db.func.coalesce(db.func.sum(Orders.quantity), 0),
+        db.func.count(Orders.id)).filter(
+        Orders.order_date.isnot(None), Orders.item_id.isnot(None))
+    if condition is not None:
+        query = query.filter(condition)
+    # a fixed order of the upserted rows avoids deadlocks between writers
+    return query.group_by(day, Orders.item_id).order_by(
+        day, Orders.item_id).statement
+
+
+def add_daily_sales(condition):
+    # add the (already inserted) orders matching 'condition' to the rollup
+    table = DailySales.__table__
+    db.session.execute(upsert_daily_sales(postgresql.insert(table).from_select(
+        ['day', 'item_id', 'revenue', 'quantity', 'num_orders'],
+        daily_sales_select(condition))))
+
+
+def subtract_daily_sales(orders):
+    '''
+    Take 'orders', rows of (order_date, item_id, quantity, amount_due) as
+    they were stored, out of the rollup.
+    '''
+    totals = {}
+    for order_date, item_id, quantity, amount_due in orders:
+        if order_date is None or item_id is None:
+            continue
+        total = totals.setdefault((order_date.date(), item_id), [0, 0, 0])
+        total[0] -= amount_due or 0
+        total[1] -= quantity or 0
+        total[2] -= 1
+    if not totals:
+        return
+    rows = [{'day': day, 'item_id': item_id, 'revenue': revenue,
+             'quantity': quantity, 'num_orders': num_orders}
+            for (day, item_id), (revenue, quantity, num_orders)
+            in sorted(totals.items())]
+    db.session.execute(upsert_daily_sales(
+        postgresql.insert(DailySales.__table__).values(rows)))
+
+
+def delete_orders(condition):
+    '''
+    Delete the orders matching 'condition' with one DELETE ... RETURNING
+    and take exactly the deleted rows out of the rollup. Returns the number
+    of deleted orders.
+    '''
+    table = Orders.__table__
+    deleted = db.session.execute(table.delete().where(condition).returning(
+        table.c.order_date, table.c.item_id, table.c.quantity,
+        table.c.amount_due)).fetchall()
+    subtract_daily_sales(deleted)
+    return len(deleted)
+
+
+def rebuild_daily_sales(start=None, end=None):
+    '''
+    Recompute the rollup from the orders table, for the days from 'start'
+    to 'end' (dates, both included) or for all days. Runs in the current
+    transaction, the caller commits.
+    '''
+    table = DailySales.__table__
+    condition = db.true()
+    delete_condition = db.true()
+    # whole days of order_date, so that the index on it is used
+    if start is not None:
+        condition = db.and_(condition, Orders.order_date >= start)
+        delete_condition = db.and_(delete_condition, table.c.day >= start)
+    if end is not None:
+        condition = db.and_(condition,
+                            Orders.order_date < end + timedelta(days=1))
+        delete_condition = db.and_(delete_condition, table.c.day <= end)
+    db.session.execute(table.delete().where(delete_condition))
+    add_daily_sales(condition)
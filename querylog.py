@@ -0,0 +1,106 @@
+import os
+import re
+import time
+import logging
+import warnings
+from collections import namedtuple
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# queries taking at least this many milliseconds are logged as slow
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+# largest number of times one request may run the same statement shape
+# before it is reported as a probable N+1 query (testing and debug only)
+QUERY_REPEAT_LIMIT = int(os.environ.get('QUERY_REPEAT_LIMIT', 20))
+
+logger = logging.getLogger(__name__)
+
+# statement run by a request, 'duration' in seconds
+QueryRecord = namedtuple('QueryRecord', ['statement', 'duration', 'route'])
+
+# bound parameters (%(name)s, %s or ?), numbers and quoted strings
+LITERAL_PATTERN = re.compile(r"%\(\w+\)s|%s|\?|\b\d+\b|'(?:[^']|'')*'")
+# parameter lists of any length, e.g. the values of an IN (...)
+LIST_PATTERN = re.compile(r'\(\?(?:\s*,\s*\?)+\)')
+
+
+class RepeatedQueryError(Exception):
+    '''
+    Raised in testing mode when one request runs the same statement shape
+    more than QUERY_REPEAT_LIMIT times.
+    '''
+    pass
+
+
+def statement_shape(statement):
+    # the statement with its literals and parameters replaced by '?', so
+    # that the queries of a loop have the same shape
+    shape = LITERAL_PATTERN.sub('?', statement)
+    shape = LIST_PATTERN.sub('(?)', shape)
+    return ' '.join(shape.split())
+
+
+def get_route():
+    if request.url_rule is None:
+        return request.path
+    return request.url_rule.rule
+
+
+def check_repeats(statement):
+    # count the statement shapes of the request and report the first shape
+    # that runs more than QUERY_REPEAT_LIMIT times
+    shapes = g.setdefault('query_shapes', {})
+    shape = statement_shape(statement)
+    shapes[shape] = shapes.get(shape, 0) + 1
+    if shapes[shape] != QUERY_REPEAT_LIMIT + 1:
+        return
+    message = '{} {} ran the same statement more than {} times: {}'.format(
+        request.method, get_route(), QUERY_REPEAT_LIMIT, shape)
+    if current_app.testing:
+        raise RepeatedQueryError(message)
+    warnings.warn(message, RuntimeWarning, stacklevel=2)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if has_request_context() and (current_app.testing or current_app.debug):
+        check_repeats(statement)
+    conn.info.setdefault('query_log_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    duration = time.perf_counter() - conn.info['query_log_start'].pop()
+    route = get_route() if has_request_context() else None
+    if has_request_context():
+        g.setdefault('queries', []).append(
+            QueryRecord(statement, duration, route))
+    logger.debug('%.1f ms %s: %s', duration * 1000, route, statement)
+    if duration * 1000 >= SLOW_QUERY_MS:
+        logger.warning('slow query (%.1f ms) in %s: %s',
+                       duration * 1000, route, statement)
+
+
+def handle_error(context):
+    # a failed query never reaches after_cursor_execute
+    query_start = context.connection.info.get('query_log_start')
+    if query_start:
+        query_start.pop()
+
+
+def init_query_log():
+    '''
+    Record the text, duration and calling route of every statement. The
+    statements of the current request are kept in g.queries, slow queries
+    are logged, and in testing (debug) mode a statement shape repeated more
+    than QUERY_REPEAT_LIMIT times in one request raises RepeatedQueryError
+    (warns). The listeners are set on the Engine class, so they also cover
+    engines created after a new SQLAlchemy state is bound to the app.
+    '''
+    if event.contains(Engine, 'before_cursor_execute',
+                      before_cursor_execute):
+        return
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(Engine, 'handle_error', handle_error)
@@ -0,0 +1,165 @@
+'''
+Encoding of the API responses and decoding of the request bodies. The JSON
+encoder is pluggable: the JSON_BACKEND setting picks 'orjson' (several
+times faster on large lists, an optional dependency), 'json' (the standard
+library) or 'auto' (orjson when it is installed, the default).
+
+Both backends produce the same documents: compact, UTF-8, keys sorted
+when JSON_SORT_KEYS is set (as flask.jsonify does) and dates and datetimes
+written as HTTP dates ('Wed, 06 Jan 2021 00:00:00 GMT'), the format Flask's
+own encoder has always used for the order dates.
+
+Clients that send 'Accept: application/msgpack' get the same documents
+encoded as MessagePack instead, and may send MessagePack request bodies
+(Content-Type: application/msgpack). This needs the optional msgpack
+package; without it every response is JSON.
+'''
+import json
+from datetime import date
+from flask import current_app, request, has_request_context, abort
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+# media types of MessagePack, the first one is used for responses
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+
+def encode_default(value):
+    # values the JSON and MessagePack encoders do not encode natively
+    if isinstance(value, date):
+        # covers datetime, the same conversion as flask.json.JSONEncoder
+        return http_date(value.timetuple())
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError('Object of type {} is not JSON serializable'.format(
+        type(value).__name__))
+
+
+class StdlibJSONBackend:
+    # JSON encoding with the standard library json module
+    name = 'json'
+
+    def __init__(self, sort_keys=True):
+        self.sort_keys = sort_keys
+
+    def dumps(self, value):
+        # returns 'value' encoded as UTF-8 JSON bytes
+        return json.dumps(value, default=encode_default, ensure_ascii=False,
+                          separators=(',', ':'),
+                          sort_keys=self.sort_keys).encode('utf-8')
+
+
+class OrjsonBackend:
+    # JSON encoding with orjson, which is written in Rust
+    name = 'orjson'
+
+    def __init__(self, sort_keys=True):
+        # hand dates to encode_default, orjson writes ISO 8601 by itself
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            self.options |= orjson.OPT_SORT_KEYS
+
+    def dumps(self, value):
+        # returns 'value' encoded as UTF-8 JSON bytes
+        return orjson.dumps(value, default=encode_default,
+                            option=self.options)
+
+
+def create_json_backend(name='auto', sort_keys=True):
+    '''
+    JSON backend called 'name': 'orjson', 'json' or 'auto', which uses
+    orjson when it is installed and the standard library otherwise.
+    '''
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError(
+                "JSON_BACKEND is 'orjson' but orjson is not installed")
+        return OrjsonBackend(sort_keys)
+    if name == 'json':
+        return StdlibJSONBackend(sort_keys)
+    raise ValueError('unknown JSON_BACKEND {!r}'.format(name))
+
+
+def init_serialization(app):
+    # set up the JSON backend of 'app' from its JSON_BACKEND setting
+    app.extensions['json_backend'] = create_json_backend(
+        app.config.get('JSON_BACKEND'), app.config['JSON_SORT_KEYS'])
+
+    @app.after_request
+    def vary_on_accept(response):
+        # the body depends on the Accept header, so must HTTP caches
+        response.vary.add('Accept')
+        return response
+
+
+def wants_msgpack():
+    # True if the client of the current request prefers MessagePack
+    if msgpack is None or not has_request_context():
+        return False
+    best = request.accept_mimetypes.best_match(
+        (JSON_MIMETYPE,) + MSGPACK_MIMETYPES)
+    return best in MSGPACK_MIMETYPES
+
+
+def dumps(value):
+    # 'value' encoded by the JSON backend of the current app
+    return current_app.extensions['json_backend'].dumps(value)
+
+
+def msgpack_packer():
+    # MessagePack encoder writing the same values as the JSON backends
+    return msgpack.Packer(default=encode_default, use_bin_type=True)
+
+
+def jsonify(*args, **kwargs):
+    '''
+    flask.jsonify encoding with the JSON backend of the current app, or as
+    MessagePack if the client asked for it (see wants_msgpack). Takes a
+    single value, or the arguments of dict().
+    '''
+    if args and kwargs:
+        raise TypeError('jsonify() takes either args or kwargs, not both')
+    if len(args) == 1:
+        value = args[0]
+    else:
+        value = args or kwargs
+    if wants_msgpack():
+        return current_app.response_class(msgpack_packer().pack(value),
+                                          mimetype=MSGPACK_MIMETYPE)
+    return current_app.response_class(dumps(value) + b'\n',
+                                      mimetype=JSON_MIMETYPE)
+
+
+def get_request_body(expected=dict):
+    '''
+    The decoded body of the current request, like request.get_json():
+    JSON or MessagePack depending on its Content-Type. A body that cannot
+    be decoded, or does not decode to an 'expected' value (an object by
+    default, a list for the bulk endpoints), is a 400.
+    '''
+    if request.mimetype in MSGPACK_MIMETYPES:
+        if msgpack is None:
+            abort(400)
+        try:
+            body = msgpack.unpackb(request.get_data(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException):
+            abort(400)
+    else:
+        body = request.get_json()
+    if not isinstance(body, expected):
+        abort(400)
+    return body
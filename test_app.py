@@ -1,10 +1,21 @@
 import os
+import gzip
 import unittest
+import threading
 import json
+import msgpack
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from prometheus_client import REGISTRY
+from flask import g
 
-from app import create_app
-from models import setup_db, Customer, Item, Orders
+import querylog
+import compression
+from querylog import RepeatedQueryError
+
+from app import create_app, MAX_PAGE_SIZE
+from models import (setup_db, db, Customer, Item, Orders, DailySales,
+                    bump_version, item_catalog)
 
 # User JWT's. See README for each users permissions
 manager_jwt = {
@@ -22,11 +33,20 @@ salesperson_jwt = {
     'Authorization': os.environ['SALESPERSON_TOKEN']
 }
 
+# manager requests sending and accepting MessagePack
+manager_msgpack = {
+    'Content-Type': 'application/msgpack',
+    'Accept': 'application/msgpack',
+    'Authorization': os.environ['MANAGER_TOKEN']
+}
+
 
 class WarehouseAppTestCase(unittest.TestCase):
 
     def setUp(self):
         self.app = create_app()
+        # testing mode turns repeated queries (N+1) into errors
+        self.app.testing = True
         self.client = self.app.test_client
         self.database_name = 'test_capstone_test'
         self.database_path = 'postgres://{}/{}'.format(
@@ -56,6 +76,39 @@ class WarehouseAppTestCase(unittest.TestCase):
     def tearDown(self):
         pass
 
+    def count_queries(self, url):
+        # send a GET request to 'url' and count the SQL statements it ran
+        res, statements = self.record_queries(url)
+        return res, len(statements)
+
+    def record_queries(self, url):
+        # send a GET request to 'url' and return the SQL statements it ran
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(url, headers=manager_jwt)
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return res, statements
+
+    def explain(self, statement, params):
+        '''
+        return the query plan of 'statement' with sequential scans disabled,
+        so that an index shows up in the plan whenever it can serve the
+        query (the sample tables are too small for the planner to prefer
+        an index on its own)
+        '''
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        plan = db.session.execute('EXPLAIN ' + statement, params).fetchall()
+        db.session.rollback()
+        return '\n'.join(row[0] for row in plan)
+
     ''' NOTE: All data that is added to the database during testing is<br>
     deleted by the end of each test unit in order to not interfere with<br>
     future tests'''
@@ -121,6 +174,35 @@ class WarehouseAppTestCase(unittest.TestCase):
         self.assertEqual(data['num_of_remaining_customers'],
                          (num_of_current_customers - 1))
 
+    def test_post_customers_bulk(self):
+        customers = [self.new_customer,
+                     {'name': 'test_bulk_customer', 'email': 'bulk_email'},
+                     {'name': 'test_customer_without_email'}]
+        res = self.client().post('/customers/bulk', headers=manager_jwt,
+                                 json=customers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['num_created'], 2)
+        # the invalid record is reported without aborting the batch
+        self.assertEqual(data['errors'][0]['index'], 2)
+        # verify that the customers were inserted in order
+        for created, record in zip(data['created'], customers):
+            customer = Customer.query.filter_by(
+                id=created['id']).one_or_none()
+            self.assertEqual(customer.name, record['name'])
+            # delete new customer
+            customer.delete()
+
+    def test_400_post_customers_bulk_without_array(self):
+        res = self.client().post('/customers/bulk', headers=manager_jwt,
+                                 json=self.new_customer)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
     def test_get_items(self):
         res = self.client().get('/items', headers=manager_jwt)
         data = json.loads(res.data)
@@ -143,6 +225,50 @@ class WarehouseAppTestCase(unittest.TestCase):
         # delete new item once test has completed
         item.delete()
 
+    def test_post_items_bulk_reports_duplicate_names(self):
+        # create and insert an item whose name is reused in the batch
+        item = Item(
+            name=self.new_item['name'],
+            brand=self.new_item['brand'],
+            price=self.new_item['price'])
+        item.insert()
+        items = [{'name': 'test bulk item', 'brand': 'test brand',
+                  'price': 5},
+                 self.new_item,
+                 {'name': 'test bulk item', 'brand': 'test brand',
+                  'price': 5},
+                 {'name': 'test priceless item', 'brand': 'test brand'}]
+        res = self.client().post('/items/bulk', headers=manager_jwt,
+                                 json=items)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['num_created'], 1)
+        self.assertEqual(data['created'][0]['index'], 0)
+        # duplicates of existing and of earlier records and the record<br>
+        # without a price are reported
+        self.assertEqual([error['index'] for error in data['errors']],
+                         [1, 2, 3])
+        # delete items once test has completed
+        Item.query.filter_by(id=data['created'][0]['id']).one().delete()
+        item.delete()
+
+    def test_post_items_bulk_rejects_out_of_range_integers(self):
+        items = [{'name': 'test bulk item', 'brand': 'test brand',
+                  'price': 5},
+                 {'name': 'test costly item', 'brand': 'test brand',
+                  'price': 2 ** 31}]
+        res = self.client().post('/items/bulk', headers=manager_jwt,
+                                 json=items)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([created['index'] for created in data['created']],
+                         [0])
+        self.assertEqual(data['errors'],
+                         [{'index': 1, 'error': "'price' is out of range"}])
+        Item.query.filter_by(id=data['created'][0]['id']).one().delete()
+
     def test_update_item(self):
         # create and insert item to be updated
         item = Item(
@@ -193,6 +319,520 @@ class WarehouseAppTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['orders_list']))
 
+    def test_get_orders_query_count_is_fixed(self):
+        # create a customer and item to include in the mock orders
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(
+            name=self.new_item['name'],
+            brand=self.new_item['brand'],
+            price=self.new_item['price'])
+        item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        first_order = Orders(customer_id=customer_id, item_id=item_id,
+                             quantity=1)
+        first_order.insert()
+        # only list the mock orders
+        url = '/orders?after={}'.format(first_order.id - 1)
+
+        res, one_order_queries = self.count_queries(url)
+        self.assertEqual(len(json.loads(res.data)['orders_list']), 1)
+        # add more orders, the number of queries must not change
+        for quantity in range(2, 6):
+            Orders(customer_id=customer_id, item_id=item_id,
+                   quantity=quantity).insert()
+        res, five_order_queries = self.count_queries(url)
+        data = json.loads(res.data)
+
+        self.assertEqual(len(data['orders_list']), 5)
+        self.assertEqual(data['orders_list'][0]['customer_name'],
+                         self.new_customer['name'])
+        self.assertEqual(data['orders_list'][0]['item_name'],
+                         self.new_item['name'])
+        self.assertEqual(five_order_queries, one_order_queries)
+
+        # deleting the customer and item also deletes the mock orders
+        customer.delete()
+        item.delete()
+
+    def test_get_customers_with_sparse_fields(self):
+        res, statements = self.record_queries('/customers?fields=name')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(data['customers']))
+        # 'id' is always included, it is the pagination cursor
+        for customer in data['customers']:
+            self.assertEqual(set(customer), {'id', 'name'})
+        # the email column is not selected
+        self.assertFalse([statement for statement in statements
+                          if 'customer.email' in statement])
+
+    def test_get_orders_with_sparse_fields(self):
+        res, statements = self.record_queries(
+            '/orders?fields=quantity,order_date')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for order in data['orders_list']:
+            self.assertEqual(set(order), {'id', 'order_date', 'quantity'})
+        # the customer and item names are not joined in
+        self.assertFalse([statement for statement in statements
+                          if 'JOIN' in statement])
+
+    def test_get_items_with_sparse_fields(self):
+        res = self.client().get('/items?fields=id', headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for item in data['items']:
+            self.assertEqual(set(item), {'id'})
+
+    def test_400_get_items_with_unknown_field(self):
+        res = self.client().get('/items?fields=name,cost',
+                                headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_revenue_reports(self):
+        # mock orders on two days far in the future, so that no other
+        # orders fall into the date range
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(
+            name=self.new_item['name'],
+            brand=self.new_item['brand'],
+            price=self.new_item['price'])
+        item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        for order_date, quantity in [('2099-01-01 10:00', 1),
+                                     ('2099-01-01 23:30', 2),
+                                     ('2099-01-02 08:00', 3)]:
+            Orders(order_date=order_date, customer_id=customer_id,
+                   item_id=item_id, quantity=quantity,
+                   amount_due=quantity * 50).insert()
+
+        res = self.client().get(
+            '/reports/revenue/day?start=2099-01-01&end=2099-01-02',
+            headers=manager_jwt)
+        days = json.loads(res.data)
+        res = self.client().get(
+            '/reports/revenue/customer?start=2099-01-02&end=2099-01-02',
+            headers=manager_jwt)
+        customers = json.loads(res.data)
+        res = self.client().get(
+            '/reports/revenue/brand?start=2099-01-01', headers=manager_jwt)
+        brands = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(days['revenue_list'], [
+            {'day': '2099-01-01', 'revenue': 150, 'quantity': 3,
+             'num_orders': 2},
+            {'day': '2099-01-02', 'revenue': 150, 'quantity': 3,
+             'num_orders': 1}])
+        self.assertEqual(customers['revenue_list'], [
+            {'customer_id': customer_id,
+             'customer_name': self.new_customer['name'],
+             'revenue': 150, 'quantity': 3, 'num_orders': 1}])
+        self.assertEqual(brands['revenue_list'], [
+            {'brand': self.new_item['brand'], 'revenue': 300,
+             'quantity': 6, 'num_orders': 3}])
+
+        # deleting the customer and item also deletes the mock orders
+        customer.delete()
+        item.delete()
+
+    def daily_sales_of(self, item_id):
+        # the rollup rows of an item, and the same totals computed from the
+        # orders themselves
+        with self.app.app_context():
+            rollup = db.session.query(
+                DailySales.day, DailySales.revenue, DailySales.quantity,
+                DailySales.num_orders).filter(
+                DailySales.item_id == item_id,
+                DailySales.num_orders > 0).order_by(DailySales.day).all()
+            day = db.func.date(Orders.order_date)
+            orders = db.session.query(
+                day, db.func.sum(Orders.amount_due),
+                db.func.sum(Orders.quantity), db.func.count(Orders.id)).filter(
+                Orders.item_id == item_id).group_by(day).order_by(day).all()
+        return ([tuple(row) for row in rollup],
+                [tuple(row) for row in orders])
+
+    def test_daily_sales_follow_order_writes(self):
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(
+            name=self.new_item['name'],
+            brand=self.new_item['brand'],
+            price=self.new_item['price'])
+        item.insert()
+        customer_id = customer.id
+        item_id = item.id
+
+        res = self.client().post('/submit_order', headers=manager_jwt,
+                                 json={'customer_id': customer_id,
+                                       'item_id': item_id, 'quantity': 2})
+        order_id = json.loads(res.data)['order_id']
+        self.client().post('/orders/bulk', headers=manager_jwt, json=[
+            {'customer_id': customer_id, 'item_id': item_id, 'quantity': 3},
+            {'customer_id': customer_id, 'item_id': item_id, 'quantity': 4}])
+        rollup, orders = self.daily_sales_of(item_id)
+        self.assertEqual(rollup, orders)
+        self.assertEqual(rollup[0][1:], (450, 9, 3))
+
+        self.client().delete('/delete_order/{}'.format(order_id),
+                             headers=manager_jwt)
+        rollup, orders = self.daily_sales_of(item_id)
+        self.assertEqual(rollup, orders)
+        self.assertEqual(rollup[0][1:], (350, 7, 2))
+
+        # deleting the customer takes its remaining orders out as well
+        customer.delete()
+        rollup, orders = self.daily_sales_of(item_id)
+        self.assertEqual(rollup, [])
+        self.assertEqual(orders, [])
+        item.delete()
+
+    def test_400_revenue_report_with_invalid_date_range(self):
+        res = self.client().get(
+            '/reports/revenue/day?start=2021-02-01&end=2021-01-01',
+            headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_404_revenue_report_with_unknown_group(self):
+        res = self.client().get('/reports/revenue/weekday',
+                                headers=manager_jwt)
+
+        self.assertEqual(res.status_code, 404)
+
+    # test that the hot orders queries use the indexes added by the<br>
+    # 6cbc2b9efbd6 migration (run 'python manage.py db upgrade' first)
+    def test_orders_by_customer_uses_index(self):
+        plan = self.explain('SELECT * FROM orders WHERE customer_id = :id',
+                            {'id': 1})
+
+        self.assertIn('ix_orders_customer_id', plan)
+
+    def test_orders_by_item_uses_index(self):
+        # the lookup done when an item is deleted with its orders
+        plan = self.explain('SELECT * FROM orders WHERE item_id = :id',
+                            {'id': 1})
+
+        self.assertIn('ix_orders_item_id', plan)
+
+    # the /items filter indexes added by the 9d41c7e2b6f3 migration
+    def test_items_by_brand_uses_index(self):
+        plan = self.explain('SELECT id FROM item WHERE lower(brand) = :brand',
+                            {'brand': 'nike'})
+
+        self.assertIn('ix_item_brand_lower', plan)
+
+    def test_items_by_price_uses_index(self):
+        plan = self.explain('SELECT id FROM item WHERE price BETWEEN :low '
+                            'AND :high', {'low': 10, 'high': 50})
+
+        self.assertIn('ix_item_price', plan)
+
+    def test_orders_by_date_uses_index(self):
+        plan = self.explain('SELECT * FROM orders WHERE order_date >= :start '
+                            'AND order_date < :end',
+                            {'start': '2021-01-01', 'end': '2021-02-01'})
+
+        self.assertIn('ix_orders_order_date', plan)
+
+    def test_items_filters(self):
+        # items differing in name, brand and price
+        items = [Item(name='test filter shoe', brand='Test Brand A',
+                      price=20),
+                 Item(name='test filter boot', brand='test brand a',
+                      price=80),
+                 Item(name='test filter sock', brand='Test Brand B',
+                      price=5)]
+        for item in items:
+            item.insert()
+        item_ids = [item.id for item in items]
+
+        def names(url):
+            res = self.client().get(url, headers=manager_jwt)
+            return sorted(item['name'] for item in json.loads(res.data)[
+                'items'])
+
+        self.assertEqual(names('/items?q=FILTER%20S'),
+                         ['test filter shoe', 'test filter sock'])
+        # the brand filter ignores case
+        self.assertEqual(names('/items?q=test%20filter'
+                               '&brand=TEST%20BRAND%20A'),
+                         ['test filter boot', 'test filter shoe'])
+        self.assertEqual(names('/items?q=test%20filter&min_price=10'
+                               '&max_price=50'), ['test filter shoe'])
+        # '%' and '_' in the search are matched literally
+        self.assertEqual(names('/items?q=test_filter'), [])
+
+        for item_id in item_ids:
+            Item.query.filter_by(id=item_id).one().delete()
+
+    def test_search_customers(self):
+        customer = Customer(name='test search customer',
+                            email='test.search@example.com')
+        customer.insert()
+        customer_id = customer.id
+
+        res = self.client().get('/customers?q=SEARCH@EXAMPLE',
+                                headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([row['id'] for row in data['customers']],
+                         [customer_id])
+        Customer.query.filter_by(id=customer_id).one().delete()
+
+    def test_400_get_items_with_invalid_price_range(self):
+        res = self.client().get('/items?min_price=50&max_price=10',
+                                headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_customers_paginated(self):
+        # request the first page with a single customer
+        res = self.client().get('/customers?limit=1', headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['customers']), 1)
+        self.assertEqual(data['next_cursor'], data['customers'][0]['id'])
+        # follow the cursor to the next page
+        res = self.client().get(
+            '/customers?limit=1&after={}'.format(data['next_cursor']),
+            headers=manager_jwt)
+        next_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_page['customers'][0]['id'],
+                           data['next_cursor'])
+
+    def test_get_items_last_page(self):
+        # a page past the highest id is empty and has no next cursor
+        last_item = Item.query.order_by(Item.id.desc()).first()
+        res = self.client().get('/items?after={}'.format(last_item.id),
+                                headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['items'], [])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_orders_page_size_is_capped(self):
+        res = self.client().get('/orders?limit=1000000', headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(data['orders_list']), MAX_PAGE_SIZE)
+
+    def test_stream_customers(self):
+        res = self.client().get('/customers?stream=true',
+                                headers=manager_jwt)
+        data = json.loads(res.data)
+        # the streamed list matches the paginated one
+        paginated = json.loads(self.client().get(
+            '/customers?limit={}'.format(MAX_PAGE_SIZE),
+            headers=manager_jwt).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertTrue(data['success'])
+        self.assertEqual(data['customers'], paginated['customers'])
+
+    def test_stream_orders_after_cursor(self):
+        first_order = Orders.query.order_by(Orders.id).first()
+        res = self.client().get(
+            '/orders?stream=true&after={}'.format(first_order.id),
+            headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['num_of_orders'], len(data['orders_list']))
+        self.assertNotIn(first_order.id,
+                         [order['id'] for order in data['orders_list']])
+
+    def test_get_cache_stats(self):
+        # list the items twice so the second listing hits the cache
+        self.client().get('/items', headers=manager_jwt)
+        self.client().get('/items', headers=manager_jwt)
+        res = self.client().get('/cache_stats', headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertGreater(data['item_catalog']['hits'], 0)
+        self.assertGreater(data['item_catalog']['hit_rate'], 0)
+        self.assertGreater(data['token_cache']['hits'], 0)
+
+    def test_metrics_count_requests_and_queries(self):
+        labels = {'method': 'GET', 'route': '/customers'}
+        requests_before = REGISTRY.get_sample_value(
+            'http_requests_total', dict(labels, status='200')) or 0
+        queries_before = REGISTRY.get_sample_value(
+            'db_queries_per_request_sum', labels) or 0
+        self.client().get('/customers', headers=manager_jwt)
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_bucket', res.data)
+        self.assertIn(b'jwt_verify_duration_seconds', res.data)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'http_requests_total', dict(labels, status='200')),
+            requests_before + 1)
+        self.assertGreater(REGISTRY.get_sample_value(
+            'db_queries_per_request_sum', labels), queries_before)
+
+    def test_metrics_count_errors(self):
+        labels = {'method': 'GET', 'route': '/customers', 'status': '401',
+                  'error': 'authorization_header_missing'}
+        auth_errors_before = REGISTRY.get_sample_value(
+            'http_request_errors_total', labels) or 0
+        not_found_labels = {'method': 'GET', 'route': 'unmatched',
+                            'status': '404', 'error': 'not_found'}
+        not_found_before = REGISTRY.get_sample_value(
+            'http_request_errors_total', not_found_labels) or 0
+        self.client().get('/customers')
+        self.client().get('/no_such_endpoint')
+
+        self.assertEqual(REGISTRY.get_sample_value(
+            'http_request_errors_total', labels), auth_errors_before + 1)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'http_request_errors_total', not_found_labels),
+            not_found_before + 1)
+
+    def test_repeated_lazy_loads_raise_in_testing(self):
+        # a route reading order.customer lazily runs one query per order
+        @self.app.route('/test_lazy_orders')
+        def lazy_orders():
+            return json.dumps([order.customer.name
+                               for order in Orders.query.all()])
+
+        repeat_limit = querylog.QUERY_REPEAT_LIMIT
+        querylog.QUERY_REPEAT_LIMIT = 1
+        try:
+            with self.assertRaises(RepeatedQueryError) as context:
+                self.client().get('/test_lazy_orders')
+        finally:
+            querylog.QUERY_REPEAT_LIMIT = repeat_limit
+        self.assertIn('/test_lazy_orders', str(context.exception))
+
+    def test_queries_of_request_are_recorded(self):
+        @self.app.route('/test_recorded_queries')
+        def recorded_queries():
+            Item.query.all()
+            return json.dumps([[query.route, query.duration]
+                               for query in g.queries])
+
+        res = self.client().get('/test_recorded_queries')
+        data = json.loads(res.data)
+
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0][0], '/test_recorded_queries')
+        self.assertGreaterEqual(data[0][1], 0)
+
+    def test_304_get_items_with_current_etag(self):
+        res = self.client().get('/items', headers=manager_jwt)
+        etag = res.headers['ETag']
+        # send a conditional request with the received ETag
+        res = self.client().get(
+            '/items', headers=dict(manager_jwt, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_etag_changes_after_insert(self):
+        res = self.client().get('/customers', headers=manager_jwt)
+        etag = res.headers['ETag']
+        # insert a customer through the model helper
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        res = self.client().get(
+            '/customers',
+            headers=dict(manager_jwt, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        # delete customer after test
+        customer.delete()
+
+    def test_version_moves_only_if_the_write_commits(self):
+        etag = self.client().get('/customers',
+                                 headers=manager_jwt).headers['ETag']
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        db.session.add(customer)
+        bump_version('customer')
+        db.session.rollback()
+        res = self.client().get(
+            '/customers',
+            headers=dict(manager_jwt, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_orders_etag_changes_after_item_update(self):
+        item = Item(
+            name=self.new_item['name'],
+            brand=self.new_item['brand'],
+            price=self.new_item['price'])
+        item.insert()
+        # keep the id, the object expires after the request
+        item_id = item.id
+        etag = self.client().get('/orders',
+                                 headers=manager_jwt).headers['ETag']
+        # the order list includes item names
+        self.client().patch('/update_item/{}'.format(item_id),
+                            headers=manager_jwt,
+                            json={'name': 'updated item'})
+        res = self.client().get(
+            '/orders', headers=dict(manager_jwt, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        item.delete()
+
+    def test_get_items_reloads_entries_older_than_the_etag(self):
+        item = Item(name='test catalog version', brand='Test Brand',
+                    price=20)
+        item.insert()
+        item_id = item.id
+        url = '/items?q=test%20catalog%20version'
+        self.client().get(url, headers=manager_jwt)
+        # a write by another worker, whose invalidation never reaches<br>
+        # this one: only the version stamp moves
+        db.session.query(Item).filter_by(id=item_id).update({'price': 30})
+        db.session.commit()
+        bump_version('item')
+        res = self.client().get(url, headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual([item['price'] for item in data['items']], [30])
+        Item.query.get(item_id).delete()
+
+    def test_400_get_items_with_invalid_limit(self):
+        res = self.client().get('/items?limit=zero', headers=manager_jwt)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
     def test_submit_order(self):
         # create a customer to be inserted into database
         customer = Customer(
@@ -226,6 +866,268 @@ class WarehouseAppTestCase(unittest.TestCase):
         customer.delete()
         item.delete()
 
+    def test_submit_orders_bulk(self):
+        # create a customer, an available and an unavailable item
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(
+            name=self.new_item['name'],
+            brand=self.new_item['brand'],
+            price=self.new_item['price'])
+        item.insert()
+        unavailable_item = Item(name='unavailable item',
+                                brand='unavailable brand', price=100,
+                                available=False)
+        unavailable_item.insert()
+        # keep the ids, the objects expire after the request
+        customer_id = customer.id
+        item_id = item.id
+        missing_item_id = unavailable_item.id + 1000000
+        orders = [{'customer_id': customer_id, 'item_id': item_id,
+                   'quantity': 2},
+                  {'customer_id': customer_id,
+                   'item_id': unavailable_item.id, 'quantity': 1},
+                  {'customer_id': customer_id, 'item_id': missing_item_id,
+                   'quantity': 1},
+                  {'customer_id': customer_id, 'item_id': item_id}]
+        res = self.client().post('/orders/bulk', headers=manager_jwt,
+                                 json=orders)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['num_created'], 1)
+        self.assertEqual([(error['index'], error['error'])
+                          for error in data['errors']],
+                         [(1, 'item not available'), (2, 'item not found'),
+                          (3, "missing 'quantity'")])
+        order = Orders.query.filter_by(
+            id=data['created'][0]['order_id']).one_or_none()
+        # verify that amount due was computed from the item price
+        self.assertEqual(order.amount_due, 2 * self.new_item['price'])
+        # after tests are passed delete all mock data
+        order.delete()
+        customer.delete()
+        item.delete()
+        unavailable_item.delete()
+
+    def test_submit_order_uses_updated_item_price(self):
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(
+            name=self.new_item['name'],
+            brand=self.new_item['brand'],
+            price=self.new_item['price'])
+        item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        order = {'customer_id': customer_id, 'item_id': item_id,
+                 'quantity': 1}
+        # the price is read by the stock reservation of every order
+        res = self.client().post('/submit_order', headers=manager_jwt,
+                                 json=order)
+        first_order_id = json.loads(res.data)['order_id']
+        self.client().patch('/update_item/{}'.format(item_id),
+                            headers=manager_jwt, json={'price': 70})
+        res = self.client().post('/submit_order', headers=manager_jwt,
+                                 json=order)
+        second_order_id = json.loads(res.data)['order_id']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Orders.query.get(first_order_id).amount_due,
+                         self.new_item['price'])
+        self.assertEqual(Orders.query.get(second_order_id).amount_due, 70)
+        # deleting the customer and item also deletes the orders
+        customer.delete()
+        item.delete()
+        self.assertIsNone(item_catalog.cache.get(item_id))
+
+    def test_submit_order_takes_units_out_of_stock(self):
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(name=self.new_item['name'], brand=self.new_item['brand'],
+                    price=self.new_item['price'], stock=5)
+        item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        order = {'customer_id': customer_id, 'item_id': item_id,
+                 'quantity': 3}
+
+        res = self.client().post('/submit_order', headers=manager_jwt,
+                                 json=order)
+        self.assertEqual(res.status_code, 200)
+        # only 2 units are left
+        res = self.client().post('/submit_order', headers=manager_jwt,
+                                 json=order)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(Item.query.get(item_id).stock, 2)
+        # restocking the item accepts the order again
+        res = self.client().patch('/update_item/{}'.format(item_id),
+                                  headers=manager_jwt, json={'stock': 10})
+        self.assertEqual(json.loads(res.data)['item_stock'], 10)
+        res = self.client().post('/submit_order', headers=manager_jwt,
+                                 json=order)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Item.query.get(item_id).stock, 7)
+
+        Customer.query.get(customer_id).delete()
+        Item.query.get(item_id).delete()
+
+    def test_400_submit_order_with_invalid_quantity(self):
+        res = self.client().post('/submit_order', headers=manager_jwt,
+                                 json={'customer_id': 1, 'item_id': 1,
+                                       'quantity': -1})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_concurrent_orders_never_oversell(self):
+        # many clients order one unit each of an item with fewer units in<br>
+        # stock, all at the same time
+        num_clients = 30
+        stock = 10
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(name=self.new_item['name'], brand=self.new_item['brand'],
+                    price=self.new_item['price'], stock=stock)
+        item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        order = {'customer_id': customer_id, 'item_id': item_id,
+                 'quantity': 1}
+        start = threading.Barrier(num_clients)
+        status_codes = []
+
+        def submit_order():
+            client = self.app.test_client()
+            start.wait()
+            res = client.post('/submit_order', headers=manager_jwt,
+                              json=order)
+            status_codes.append(res.status_code)
+
+        clients = [threading.Thread(target=submit_order)
+                   for _ in range(num_clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        self.assertEqual(status_codes.count(200), stock)
+        self.assertEqual(status_codes.count(422), num_clients - stock)
+        self.assertEqual(db.session.query(Item.stock).filter_by(
+            id=item_id).scalar(), 0)
+        self.assertEqual(Orders.query.filter_by(item_id=item_id).count(),
+                         stock)
+        self.assertEqual(db.session.query(db.func.sum(DailySales.quantity))
+                         .filter_by(item_id=item_id).scalar(), stock)
+
+        Customer.query.get(customer_id).delete()
+        Item.query.get(item_id).delete()
+
+    def test_post_orders_bulk_rejects_orders_beyond_stock(self):
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(name=self.new_item['name'], brand=self.new_item['brand'],
+                    price=self.new_item['price'], stock=4)
+        item.insert()
+        untracked_item = Item(name='test untracked item', brand='test',
+                              price=10)
+        untracked_item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        untracked_item_id = untracked_item.id
+        # the two orders of 'item' need 5 units, so both are rejected
+        res = self.client().post('/orders/bulk', headers=manager_jwt, json=[
+            {'customer_id': customer_id, 'item_id': item_id, 'quantity': 2},
+            {'customer_id': customer_id, 'item_id': untracked_item_id,
+             'quantity': 100},
+            {'customer_id': customer_id, 'item_id': item_id, 'quantity': 3}])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([order['index'] for order in data['created']], [1])
+        self.assertEqual([(error['index'], error['error'])
+                          for error in data['errors']],
+                         [(0, 'insufficient stock'),
+                          (2, 'insufficient stock')])
+        self.assertEqual(Item.query.get(item_id).stock, 4)
+
+        Customer.query.get(customer_id).delete()
+        Item.query.get(item_id).delete()
+        Item.query.get(untracked_item_id).delete()
+
+    def test_post_orders_bulk_rejects_out_of_range_integers(self):
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(name=self.new_item['name'], brand=self.new_item['brand'],
+                    price=0)
+        item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        largest = 2 ** 31 - 1
+        res = self.client().post('/orders/bulk', headers=manager_jwt, json=[
+            {'customer_id': customer_id, 'item_id': item_id,
+             'quantity': largest},
+            {'customer_id': customer_id, 'item_id': 2 ** 40,
+             'quantity': 1},
+            {'customer_id': customer_id, 'item_id': item_id,
+             'quantity': 2 ** 40},
+            # together with the first order it needs too many units
+            {'customer_id': customer_id, 'item_id': item_id,
+             'quantity': 1}])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([order['index'] for order in data['created']], [0])
+        self.assertEqual([(error['index'], error['error'])
+                          for error in data['errors']],
+                         [(1, "'item_id' is out of range"),
+                          (2, "'quantity' is out of range"),
+                          (3, "'quantity' is out of range")])
+
+        Customer.query.get(customer_id).delete()
+        Item.query.get(item_id).delete()
+
+    def test_post_orders_bulk_reads_items_from_the_database(self):
+        customer = Customer(
+            name=self.new_customer['name'], email=self.new_customer['email'])
+        customer.insert()
+        item = Item(name=self.new_item['name'], brand=self.new_item['brand'],
+                    price=self.new_item['price'])
+        item.insert()
+        other_item = Item(name='test other item', brand='test', price=10)
+        other_item.insert()
+        customer_id = customer.id
+        item_id = item.id
+        other_item_id = other_item.id
+        # cache both items, then change them behind the cache's back
+        item_catalog.get_many([item_id, other_item_id])
+        db.session.query(Item).filter_by(id=item_id).update({'price': 70})
+        db.session.query(Item).filter_by(id=other_item_id).update(
+            {'available': False})
+        db.session.commit()
+        res = self.client().post('/orders/bulk', headers=manager_jwt, json=[
+            {'customer_id': customer_id, 'item_id': item_id, 'quantity': 2},
+            {'customer_id': customer_id, 'item_id': other_item_id,
+             'quantity': 1}])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            db.session.query(Orders.amount_due).filter_by(
+                id=data['created'][0]['order_id']).scalar(), 140)
+        self.assertEqual([(error['index'], error['error'])
+                          for error in data['errors']],
+                         [(1, 'item not available')])
+
+        Customer.query.get(customer_id).delete()
+        Item.query.get(item_id).delete()
+        Item.query.get(other_item_id).delete()
+
     def test_delete_order(self):
         # create customer, item and order and insert into<br>
         # database pending deletion request
@@ -412,6 +1314,8 @@ class WarehouseAppTestCase(unittest.TestCase):
         # after mock order is deleted delete customer and item too
         customer.delete()
         item.delete()
+        etag = self.client().get('/orders',
+                                 headers=manager_jwt).headers['ETag']
         # attempt to delete nonexistent order
         res = self.client().delete(
             '/delete_order/{}'.format(nonexistent_order_id),
@@ -420,6 +1324,10 @@ class WarehouseAppTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
+        # nothing was deleted, so the orders list keeps its ETag
+        res = self.client().get(
+            '/orders', headers=dict(manager_jwt, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 304)
 
     # test authentication and authorization(RBAC)
 
@@ -481,6 +1389,161 @@ class WarehouseAppTestCase(unittest.TestCase):
         self.assertEqual(data['description'],
                          'user lacks appropriate permission')
 
+    # MessagePack requests and responses
+    def test_get_items_as_msgpack(self):
+        res = self.client().get('/items', headers=manager_msgpack)
+        data = msgpack.unpackb(res.data, raw=False)
+        json_data = json.loads(self.client().get(
+            '/items', headers=manager_jwt).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/msgpack')
+        self.assertIn('Accept', res.headers['Vary'])
+        self.assertEqual(data, json_data)
+
+    def test_stream_orders_as_msgpack(self):
+        res = self.client().get('/orders?stream=true',
+                                headers=manager_msgpack)
+        data = msgpack.unpackb(res.data, raw=False)
+        json_data = json.loads(self.client().get(
+            '/orders?stream=true', headers=manager_jwt).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['num_of_orders'], len(data['orders_list']))
+        self.assertEqual(data, json_data)
+
+    def test_stream_msgpack_rows_match_the_count(self):
+        res = self.client().get('/customers?stream=true',
+                                headers=manager_msgpack, buffered=False)
+        chunks = iter(res.response)
+        # the header with the length of the list has been sent
+        header = next(chunks)
+        created = []
+
+        def create_customer():
+            # insert from another thread, which has its own session
+            res = self.app.test_client().post(
+                '/new_customer', headers=manager_jwt,
+                json=self.new_customer)
+            created.append(json.loads(res.data)['id'])
+
+        thread = threading.Thread(target=create_customer)
+        thread.start()
+        thread.join()
+        # unpackb fails if the list holds more or fewer rows than its<br>
+        # length says
+        data = msgpack.unpackb(header + b''.join(chunks), raw=False)
+        res.close()
+
+        self.assertTrue(data['success'])
+        self.assertNotIn(created[0],
+                         [customer['id'] for customer in data['customers']])
+        Customer.query.get(created[0]).delete()
+
+    def test_post_customer_with_msgpack_body(self):
+        res = self.client().post('/new_customer', headers=manager_msgpack,
+                                 data=msgpack.packb(self.new_customer))
+        data = msgpack.unpackb(res.data, raw=False)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['customer'], self.new_customer['name'])
+        Customer.query.filter_by(id=data['id']).one().delete()
+
+    def test_400_post_customer_with_invalid_msgpack_body(self):
+        res = self.client().post('/new_customer', headers=manager_msgpack,
+                                 data=b'\xc1')
+        data = msgpack.unpackb(res.data, raw=False)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_400_post_bodies_that_are_not_objects(self):
+        responses = [
+            self.client().post('/new_customer', headers=manager_msgpack,
+                               data=msgpack.packb([1, 2])),
+            self.client().post('/submit_order', headers=manager_jwt,
+                               data='null'),
+            self.client().patch('/update_item/1', headers=manager_jwt,
+                                json=[1, 2])]
+
+        self.assertEqual([res.status_code for res in responses],
+                         [400, 400, 400])
+
+    def test_401_as_msgpack(self):
+        res = self.client().get('/customers',
+                                headers={'Accept': 'application/msgpack'})
+        data = msgpack.unpackb(res.data, raw=False)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['code'], 'authorization header missing')
+
+    def test_msgpack_etag_differs_from_json(self):
+        json_etag = self.client().get(
+            '/customers', headers=manager_jwt).headers['ETag']
+        res = self.client().get('/customers', headers=dict(
+            manager_msgpack, **{'If-None-Match': json_etag}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], json_etag)
+
+    # response compression
+    def get_compressed(self, url, encoding, min_size=0):
+        # GET 'url' accepting 'encoding', compressing bodies of 'min_size'<br>
+        # bytes and more
+        default_min_size = compression.COMPRESS_MIN_SIZE
+        compression.COMPRESS_MIN_SIZE = min_size
+        try:
+            return self.client().get(url, headers=dict(
+                manager_jwt, **{'Accept-Encoding': encoding}))
+        finally:
+            compression.COMPRESS_MIN_SIZE = default_min_size
+
+    def test_get_customers_gzip(self):
+        res = self.get_compressed('/customers', 'gzip, deflate')
+        plain = self.client().get('/customers', headers=manager_jwt)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        self.assertEqual(int(res.headers['Content-Length']), len(res.data))
+
+    def test_small_response_is_not_compressed(self):
+        res = self.get_compressed('/customers?limit=1', 'gzip',
+                                  min_size=10 ** 6)
+
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertTrue(json.loads(res.data)['success'])
+
+    def test_stream_orders_gzip(self):
+        # streamed responses are compressed whatever their size
+        res = self.get_compressed('/orders?stream=true', 'gzip',
+                                  min_size=10 ** 6)
+        data = gzip.decompress(res.data)
+        plain = self.client().get('/orders?stream=true',
+                                  headers=manager_jwt)
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', res.headers)
+        self.assertEqual(data, plain.data)
+
+    @unittest.skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_get_customers_brotli(self):
+        res = self.get_compressed('/customers', 'gzip, br')
+        plain = self.client().get('/customers', headers=manager_jwt)
+
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(res.data), plain.data)
+
+    def test_304_with_etag_of_compressed_response(self):
+        res = self.get_compressed('/customers', 'gzip')
+        etag = res.headers['ETag']
+        res = self.client().get('/customers', headers=dict(
+            manager_jwt, **{'If-None-Match': etag}))
+
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(res.status_code, 304)
+
 
 if __name__ == "__main__":
     unittest.main()
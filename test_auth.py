@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import base64
+import shutil
+import tempfile
+import threading
+import unittest
+from Crypto.PublicKey import RSA
+from jose import jwt
+from jose.backends.base import Key
+
+import auth
+from cache import SharedCache, RedisBackend
+from test_cache import FakeRedis
+from auth import (JWKSKeyStore, TokenCache, AuthError, parse_algorithms,
+                  parse_jwks, verify_decode_jwt)
+
+# signing key for testing purposes
+private_key = RSA.generate(2048)
+
+
+def b64_int(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+# sample JWK holding the public half of the signing key
+sample_key = {
+    'kty': 'RSA',
+    'kid': 'key-1',
+    'use': 'sig',
+    'n': b64_int(private_key.n),
+    'e': b64_int(private_key.e)
+}
+
+
+def sign_token(claims, kid='key-1'):
+    return jwt.encode(claims, private_key.export_key().decode(),
+                      algorithm='RS256', headers={'kid': kid})
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # serve the key set from a local file so the tests run offline
+        self.tmp_dir = tempfile.mkdtemp()
+        self.jwks_path = os.path.join(self.tmp_dir, 'jwks.json')
+        self.write_jwks([sample_key])
+        self.store = JWKSKeyStore('file://' + self.jwks_path, ttl=3600,
+                                  refresh_ahead=300, min_refetch_interval=30)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_jwks(self, keys):
+        with open(self.jwks_path, 'w') as jwks_file:
+            json.dump({'keys': keys}, jwks_file)
+
+    def test_key_set_is_fetched_once(self):
+        key = self.store.get_key('key-1')
+
+        self.assertIsInstance(key, Key)
+        self.assertIs(self.store.get_key('key-1'), key)
+        self.assertEqual(self.store.fetch_count, 1)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.get_key('key-1')
+        self.store.last_attempt -= self.store.min_refetch_interval
+        # first miss forces a refetch, the second one is within the interval
+        self.assertIsNone(self.store.get_key('unknown'))
+        self.assertIsNone(self.store.get_key('unknown'))
+        self.assertEqual(self.store.fetch_count, 2)
+
+    def test_unknown_kid_picks_up_rotated_key(self):
+        self.store.min_refetch_interval = 0
+        self.store.get_key('key-1')
+        rotated_key = dict(sample_key, kid='key-2')
+        self.write_jwks([sample_key, rotated_key])
+
+        self.assertIsNotNone(self.store.get_key('key-2'))
+        self.assertEqual(self.store.fetch_count, 2)
+
+    def test_failed_refresh_keeps_last_good_key_set(self):
+        self.store.get_key('key-1')
+        os.remove(self.jwks_path)
+
+        self.assertFalse(self.store.refresh())
+        self.assertIsNotNone(self.store.last_error)
+        self.assertIsNotNone(self.store.get_key('key-1'))
+
+    def test_stale_key_set_is_refreshed_in_background(self):
+        self.store.min_refetch_interval = 0
+        self.store.get_key('key-1')
+        # move the last fetch into the refresh window
+        self.store.fetched_at -= self.store.ttl
+        # the stale key is still served while the refresh runs
+        self.assertIsNotNone(self.store.get_key('key-1'))
+        for _ in range(100):
+            if self.store.fetch_count == 2 and not self.store._refreshing:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.store.fetch_count, 2)
+        self.assertLess(time.monotonic() - self.store.fetched_at, 60)
+
+    def test_concurrent_first_requests_wait_for_the_key_set(self):
+        fetch = self.store._fetch
+
+        def slow_fetch(*args):
+            time.sleep(0.1)
+            return fetch(*args)
+
+        self.store._fetch = slow_fetch
+        keys = []
+        requests = [threading.Thread(
+            target=lambda: keys.append(self.store.get_key('key-1')))
+            for _ in range(5)]
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join()
+
+        self.assertEqual(len(keys), 5)
+        self.assertTrue(all(key is not None for key in keys))
+        self.assertEqual(self.store.fetch_count, 1)
+
+    def test_503_when_key_set_was_never_loaded(self):
+        os.remove(self.jwks_path)
+
+        with self.assertRaises(AuthError) as context:
+            self.store.get_key('key-1')
+        self.assertEqual(context.exception.status_code, 503)
+
+    def test_key_set_is_shared_between_workers(self):
+        server = {'data': {}, 'subscribers': []}
+        self.store.shared = SharedCache(
+            'jwks', 1, 60, backend=RedisBackend(FakeRedis(server)))
+        other_store = JWKSKeyStore('file://' + self.jwks_path, shared=(
+            SharedCache('jwks', 1, 60,
+                        backend=RedisBackend(FakeRedis(server)))))
+        self.store.get_key('key-1')
+        # the second worker loads the key set without downloading it
+        os.remove(self.jwks_path)
+
+        self.assertIsNotNone(other_store.get_key('key-1'))
+
+
+class VerifyDecodeJWTTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        jwks_path = os.path.join(self.tmp_dir, 'jwks.json')
+        with open(jwks_path, 'w') as jwks_file:
+            json.dump({'keys': [sample_key]}, jwks_file)
+        # configure the module for a key store backed by the local key set
+        self.jwks_store = auth.jwks_store
+        auth.configure('test.auth0.com', "['RS256']", 'warehouse-api',
+                       'file://' + jwks_path)
+        self.claims = {
+            'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+            'aud': auth.API_AUDIENCE,
+            'exp': int(time.time()) + 60,
+            'permissions': ['get:items']
+        }
+
+    def tearDown(self):
+        auth.jwks_store = self.jwks_store
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_algorithms(self):
+        self.assertEqual(parse_algorithms("['RS256']"), ['RS256'])
+        self.assertEqual(parse_algorithms('RS256, RS384'),
+                         ['RS256', 'RS384'])
+
+    def test_parse_jwks_skips_unusable_keys(self):
+        keys = parse_jwks({'keys': [sample_key,
+                                    dict(sample_key, kid='enc', use='enc'),
+                                    {'kty': 'EC', 'kid': 'ec'}]})
+
+        self.assertEqual(list(keys), ['key-1'])
+
+    def test_valid_token_is_decoded(self):
+        payload = verify_decode_jwt(sign_token(self.claims))
+
+        self.assertEqual(payload['permissions'], ['get:items'])
+
+    def test_expired_token(self):
+        token = sign_token(dict(self.claims, exp=int(time.time()) - 60))
+
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(token)
+        self.assertEqual(context.exception.error['code'], 'token_expired')
+
+    def test_unknown_kid(self):
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(sign_token(self.claims, kid='unknown'))
+        self.assertEqual(context.exception.status_code, 400)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TokenCache(max_size=2)
+        self.payload = {'exp': time.time() + 60,
+                        'permissions': ['get:items']}
+
+    def test_cached_payload_is_returned(self):
+        self.assertIsNone(self.cache.get('token-1'))
+        self.cache.set('token-1', self.payload)
+
+        self.assertEqual(self.cache.get('token-1'), self.payload)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+        # the raw token is not kept in memory
+        self.assertNotIn('token-1', self.cache.entries)
+
+    def test_expired_token_is_a_miss(self):
+        self.cache.set('token-1', dict(self.payload, exp=time.time() - 1))
+
+        self.assertIsNone(self.cache.get('token-1'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_token_without_exp_is_not_cached(self):
+        self.cache.set('token-1', {'permissions': ['get:items']})
+
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_token_is_evicted(self):
+        self.cache.set('token-1', self.payload)
+        self.cache.set('token-2', self.payload)
+        # touch token-1 so that token-2 becomes the least recently used
+        self.cache.get('token-1')
+        self.cache.set('token-3', self.payload)
+
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.assertIsNotNone(self.cache.get('token-1'))
+        self.assertIsNone(self.cache.get('token-2'))
+        self.assertIsNotNone(self.cache.get('token-3'))
+
+
+if __name__ == "__main__":
+    unittest.main()
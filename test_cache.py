@@ -0,0 +1,163 @@
+import time
+import queue
+import unittest
+
+from cache import TTLCache, SharedCache, RedisBackend, LocalBackend
+
+
+class FakeRedis:
+    '''
+    In-memory stand-in for the part of the redis-py client used by
+    RedisBackend. Instances created with the same 'server' dict share
+    their data and pub/sub channels, like clients of one Redis server.
+    '''
+
+    def __init__(self, server=None):
+        self.server = server if server is not None else {
+            'data': {}, 'subscribers': []}
+
+    def mget(self, keys):
+        return [self.server['data'].get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.server['data'][key] = value.encode()
+
+    def delete(self, key):
+        self.server['data'].pop(key, None)
+
+    def publish(self, channel, message):
+        for subscriber in self.server['subscribers']:
+            subscriber.put({'channel': channel, 'data': message.encode()})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self.server)
+
+
+class FakePubSub:
+
+    def __init__(self, server):
+        self.server = server
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel):
+        self.server['subscribers'].append(self.messages)
+
+    def listen(self):
+        while True:
+            yield self.messages.get()
+
+
+class TTLCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TTLCache(max_size=2, ttl=60)
+
+    def test_cached_value_is_returned(self):
+        self.assertIsNone(self.cache.get('key-1'))
+        self.cache.set('key-1', 'value-1')
+
+        self.assertEqual(self.cache.get('key-1'), 'value-1')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['hit_rate'], 0.5)
+
+    def test_expired_value_is_a_miss(self):
+        self.cache.set('key-1', 'value-1')
+        # move the expiry time of the entry into the past
+        expiry, value = self.cache.entries['key-1']
+        self.cache.entries['key-1'] = (time.monotonic() - 1, value)
+
+        self.assertIsNone(self.cache.get('key-1'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_entry_expiry_overrides_ttl(self):
+        self.cache.set('key-1', 'value-1',
+                       expires_at=time.monotonic() - 1)
+        self.cache.set('key-2', 'value-2',
+                       expires_at=time.monotonic() + 3600)
+
+        self.assertIsNone(self.cache.get('key-1'))
+        self.assertEqual(self.cache.get('key-2'), 'value-2')
+
+    def test_least_recently_used_value_is_evicted(self):
+        self.cache.set('key-1', 'value-1')
+        self.cache.set('key-2', 'value-2')
+        # touch key-1 so that key-2 becomes the least recently used
+        self.cache.get('key-1')
+        self.cache.set('key-3', 'value-3')
+
+        self.assertEqual(self.cache.get('key-1'), 'value-1')
+        self.assertIsNone(self.cache.get('key-2'))
+        self.assertEqual(self.cache.get('key-3'), 'value-3')
+
+    def test_deleted_value_is_a_miss(self):
+        self.cache.set('key-1', 'value-1')
+        self.cache.delete('key-1')
+
+        self.assertIsNone(self.cache.get('key-1'))
+
+
+class SharedCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # two workers talking to the same cache server
+        server = {'data': {}, 'subscribers': []}
+        self.worker_1 = SharedCache('item', 10, 60,
+                                    backend=RedisBackend(FakeRedis(server)))
+        self.worker_2 = SharedCache('item', 10, 60,
+                                    backend=RedisBackend(FakeRedis(server)))
+        # start the listener threads and wait for both to subscribe
+        self.worker_1.backend.listen()
+        self.worker_2.backend.listen()
+        for _ in range(100):
+            if len(server['subscribers']) == 2:
+                break
+            time.sleep(0.01)
+
+    def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_value_loaded_by_one_worker_is_shared(self):
+        self.worker_1.set(1, {'price': 10})
+
+        self.assertEqual(self.worker_2.get(1), {'price': 10})
+        self.assertEqual(self.worker_2.stats()['shared_hits'], 1)
+        # the value is now also held locally by the second worker
+        self.assertEqual(self.worker_2.local.get('1'), {'price': 10})
+
+    def test_invalidation_reaches_every_worker(self):
+        self.worker_1.set(1, {'price': 10})
+        self.worker_2.get(1)
+        self.worker_1.invalidate(1)
+
+        self.assertTrue(self.wait_for(
+            lambda: self.worker_2.local.get('1') is None))
+        self.assertIsNone(self.worker_2.get(1))
+
+    def test_other_namespaces_are_not_invalidated(self):
+        server = self.worker_1.backend.client.server
+        other = SharedCache('jwks', 10, 60,
+                            backend=RedisBackend(FakeRedis(server)))
+        other.set(1, 'keys')
+        self.worker_1.invalidate(1)
+        # wait until the message has reached the other worker
+        self.worker_2.local.set('1', 'stale')
+        self.assertTrue(self.wait_for(
+            lambda: self.worker_2.local.get('1') is None))
+
+        self.assertEqual(other.get(1), 'keys')
+
+    def test_local_backend_invalidates_this_process(self):
+        cache = SharedCache('item', 10, 60, backend=LocalBackend())
+        cache.set(1, 'value')
+        cache.invalidate(1)
+
+        self.assertIsNone(cache.get(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from querylog import statement_shape
+
+
+class StatementShapeTestCase(unittest.TestCase):
+
+    def test_parameters_and_literals_are_replaced(self):
+        self.assertEqual(
+            statement_shape('SELECT * FROM item\nWHERE item.id = %(id_1)s '
+                            "AND item.name = 'shoe' LIMIT 10"),
+            'SELECT * FROM item WHERE item.id = ? AND item.name = ? LIMIT ?')
+
+    def test_in_lists_of_any_length_have_one_shape(self):
+        self.assertEqual(
+            statement_shape('SELECT * FROM item WHERE item.id IN '
+                            '(%(id_1)s, %(id_2)s)'),
+            statement_shape('SELECT * FROM item WHERE item.id IN '
+                            '(%(id_1)s, %(id_2)s, %(id_3)s)'))
+
+    def test_identifiers_with_digits_are_kept(self):
+        self.assertEqual(statement_shape('SELECT anon_1.id FROM anon_1'),
+                         'SELECT anon_1.id FROM anon_1')
+
+
+if __name__ == "__main__":
+    unittest.main()
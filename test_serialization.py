@@ -0,0 +1,60 @@
+import json
+import unittest
+from datetime import date, datetime
+
+import serialization
+from serialization import (create_json_backend, StdlibJSONBackend,
+                           OrjsonBackend, msgpack_packer)
+
+# a list response with the value types the endpoints return
+PAYLOAD = {'success': True, 'status_code': 200, 'next_cursor': None,
+           'orders_list': [{'id': 1, 'quantity': 2, 'item_name': 'Café',
+                            'order_date': datetime(2021, 1, 6, 13, 5)}],
+           'start': date(2021, 1, 1)}
+
+
+class JSONBackendTestCase(unittest.TestCase):
+
+    def test_dates_are_http_dates(self):
+        data = json.loads(StdlibJSONBackend().dumps(PAYLOAD))
+
+        self.assertEqual(data['orders_list'][0]['order_date'],
+                         'Wed, 06 Jan 2021 13:05:00 GMT')
+        self.assertEqual(data['start'], 'Fri, 01 Jan 2021 00:00:00 GMT')
+
+    @unittest.skipIf(serialization.orjson is None, 'orjson is not installed')
+    def test_backends_encode_the_same_bytes(self):
+        for sort_keys in (True, False):
+            self.assertEqual(OrjsonBackend(sort_keys).dumps(PAYLOAD),
+                             StdlibJSONBackend(sort_keys).dumps(PAYLOAD))
+
+    @unittest.skipIf(serialization.msgpack is None,
+                     'msgpack is not installed')
+    def test_msgpack_encodes_the_same_document(self):
+        packed = msgpack_packer().pack(PAYLOAD)
+
+        self.assertEqual(serialization.msgpack.unpackb(packed, raw=False),
+                         json.loads(StdlibJSONBackend().dumps(PAYLOAD)))
+
+    def test_auto_falls_back_to_the_standard_library(self):
+        orjson = serialization.orjson
+        serialization.orjson = None
+        try:
+            self.assertIsInstance(create_json_backend('auto'),
+                                  StdlibJSONBackend)
+            with self.assertRaises(RuntimeError):
+                create_json_backend('orjson')
+        finally:
+            serialization.orjson = orjson
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_json_backend('yaml')
+
+    def test_unsupported_values_are_rejected(self):
+        with self.assertRaises(TypeError):
+            create_json_backend('auto').dumps({'value': object()})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,6 @@
+from app import create_app
+
+# WSGI entry point (gunicorn wsgi:app). Creating the app does not connect
+# to the database or fetch the JWKS, so it can be created once in the
+# gunicorn master (preload_app) and shared by the forked workers
+app = create_app()